@@ -4,26 +4,41 @@ import logging
 import re
 import time
 import json
+import math
+import hashlib
+import atexit
+import select
+import struct
+import queue
+import sqlite3
+import uuid
 import pyautogui
 import requests
 import shutil
 import threading
+import concurrent.futures
+from collections import Counter, defaultdict, deque
 import psutil
 import webbrowser
 import ctypes
+import ctypes.util
+from multiprocessing.managers import BaseManager, RemoteError
 from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory
 from flask_cors import CORS
 
 import subprocess
 import google.generativeai as genai
+from screen_capture import ScreenCapture, IMAGE_FORMATS, normalize_format
 
 class PredefinedCommands:
     def __init__(self, file_path):
         self.file_path = file_path
-        self.commands = self._load_commands()
+        self.commands, self.categories = self._load_commands()
 
     def _load_commands(self):
         commands_map = {}
+        categories = {}
+        category = None
         try:
             with open(self.file_path, 'r', encoding='utf-8') as f:
                 for line in f:
@@ -34,31 +49,173 @@ class PredefinedCommands:
                         shell_command = parts[1].strip()
                         if natural_command and shell_command:
                             commands_map[natural_command.lower()] = shell_command
+                            if category:
+                                categories[natural_command.lower()] = category
+                    elif line and re.match(r'^[^\w\s"(]', line):
+                        # Section headers look like "🕒 Time & Date (10)".
+                        category = re.sub(r'\s*\(\d+\)$', '', line[1:]).strip()
             logging.info(f"✅ Loaded {len(commands_map)} predefined commands from {self.file_path}")
         except FileNotFoundError:
             logging.error(f"❌ Predefined commands file not found: {self.file_path}")
         except Exception as e:
             logging.error(f"❌ Error loading predefined commands: {e}")
-        return commands_map
+        return commands_map, categories
+
+    def reload(self):
+        # The old maps stay live until the new ones are fully parsed, then reference swaps publish them.
+        self.commands, self.categories = self._load_commands()
+
+    def get_category(self, natural_language_input):
+        tokens = set(re.findall(r"[a-z0-9']+", natural_language_input.lower().replace('’', "'")))
+        best_category, best_score = None, 0.0
+        for natural_command, category in self.categories.items():
+            command_tokens = set(re.findall(r"[a-z0-9']+", natural_command.replace('’', "'")))
+            score = len(tokens & command_tokens) / (len(tokens | command_tokens) or 1)
+            if score > best_score:
+                best_category, best_score = category, score
+        return best_category if best_score >= 0.3 else None
 
     def get_command(self, natural_language_input):
         return self.commands.get(natural_language_input.lower())
 
+class IntentRouter:
+    # Only whole utterances count as chat: "hey babe!" does, "hey, lock my screen" falls through to the classifier.
+    CHAT_PATTERN = re.compile(r"(hi|hii+|hello|hey|heya|hiya|yo|sup|good (morning|afternoon|evening|night)|gn|thanks|thank you|thank u|ty|love you|i love you|i miss you|miss you|how are you|how's it going|how was your day|what's up|whats up|who are you|are you there|bye|goodbye|see you|you're (cute|sweet|amazing|the best))\b( (babe|baby|love|my love|honey|hun|sweetheart|sweetie|darling|dear|cutie)\b)?[\W_]*")
+    TASK_PATTERN = re.compile(r"\b(open|start|launch|close|kill|run|create|make|delete|remove|rename|move|copy|paste|type|search|find|show|list|take|play|pause|skip|mute|unmute|set|turn|shutdown|restart|install|download|ping|check|screenshot|lock|unlock|send|email|mail|text|message|remind|reminder|reminders|alarm|timer|schedule|calendar|weather|folder|folders|file|files|computer|pc|laptop|screen|ram|cpu|gpu|disk|drive|battery|wifi|wi-fi|ip|network|volume|brightness|time|date|memory|storage|process|processes|apps|settings)\b")
+    POLITE_PREFIX = re.compile(r"^((please|pls|plz|can you|could you|would you|will you|can u|could u)\b[\W_]*)+")
+    # How chat usually opens. The classifier may only route to chat when the text starts with one of these; anything
+    # else is treated as a possible command ("empty the recycle bin") and goes to the planner, which can still reply.
+    CHAT_OPENERS = {
+        "i", "i'm", "im", "i've", "i'd", "i'll", "you", "you're", "youre", "you've", "your", "my", "me", "we", "we're",
+        "our", "it", "it's", "its", "that", "that's", "thats", "this", "there", "what", "what's", "whats", "who",
+        "who's", "why", "how", "how's", "when", "where", "do", "does", "did", "are", "is", "was", "were", "can",
+        "could", "would", "will", "should", "have", "ok", "okay", "lol", "haha", "aww", "sorry", "nice", "yes",
+        "yeah", "no", "nah", "oh", "wow", "omg", "hmm", "so", "just", "today", "tonight", "well", "not",
+    }
+    CHAT_EXAMPLES = [
+        "hi", "hello there", "hey babe", "good morning", "good night", "how are you",
+        "how was your day", "i love you", "i missed you", "thank you so much", "thanks love",
+        "you are so sweet", "you're the best", "who are you", "are you real", "do you love me",
+        "what's your name", "i'm tired", "i had a rough day", "i feel sad today", "i'm bored",
+        "tell me something nice", "you make me happy", "goodbye", "see you later", "miss you",
+        "what do you think about me", "i'm so happy today", "cheer me up", "that's cute",
+        "lol", "haha", "ok cool", "nice", "aww", "you're funny", "sorry", "my day was good",
+    ]
+
+    def __init__(self, natural_commands, prompt_log_file):
+        self.prompt_log_file = prompt_log_file
+        self._lock = threading.Lock()
+        self.label_counts = Counter()
+        self.feature_counts = {'chat': Counter(), 'task': Counter()}
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+        self._train(natural_commands)
+
+    def _features(self, text):
+        tokens = re.findall(r"[a-z0-9']+", text.lower().replace('’', "'"))
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def _learn(self, text, label):
+        features = self._features(text)
+        self.label_counts[label] += 1
+        self.feature_counts[label].update(features)
+        self.feature_totals[label] += len(features)
+        self.vocabulary.update(features)
+
+    def _train(self, natural_commands):
+        for command in natural_commands:
+            self._learn(command, 'task')
+        for example in self.CHAT_EXAMPLES:
+            self._learn(example, 'chat')
+        logged = 0
+        skipped = 0
+        if os.path.exists(self.prompt_log_file):
+            try:
+                with open(self.prompt_log_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        # A crash mid-append can leave a truncated line; skip it and keep the rest of the log.
+                        try:
+                            entry = json.loads(line)
+                            if entry.get('intent') in self.feature_counts:
+                                self._learn(entry['prompt'], entry['intent'])
+                                logged += 1
+                        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                            skipped += 1
+            except IOError as e:
+                logging.warning(f"Could not read prompt log {self.prompt_log_file}: {e}")
+            if skipped:
+                logging.warning(f"Skipped {skipped} unreadable line(s) in prompt log {self.prompt_log_file}")
+        logging.info(f"✅ Intent router trained on {sum(self.label_counts.values())} examples ({logged} from the prompt log).")
+
+    def _chat_probability(self, text):
+        features = self._features(text)
+        total_examples = sum(self.label_counts.values())
+        vocabulary_size = len(self.vocabulary) + 1
+        scores = {}
+        for label, counts in self.feature_counts.items():
+            score = math.log((self.label_counts[label] + 1) / (total_examples + 2))
+            denominator = self.feature_totals[label] + vocabulary_size
+            for feature in features:
+                score += math.log((counts[feature] + 1) / denominator)
+            scores[label] = score
+        return 1 / (1 + math.exp(max(min(scores['task'] - scores['chat'], 50), -50)))
+
+    def classify(self, prompt, threshold):
+        text = prompt.lower().strip().replace('’', "'")
+        if self.TASK_PATTERN.search(text):
+            return 'task', 1.0
+        if self.CHAT_PATTERN.fullmatch(text):
+            return 'chat', 1.0
+        greeting = self.CHAT_PATTERN.match(text)
+        if greeting:
+            # "thanks, now email mom": the greeting says nothing about the request, so classify what follows it.
+            return self.classify(text[greeting.end():], threshold)
+        text = self.POLITE_PREFIX.sub('', text, count=1)
+        with self._lock:
+            chat_probability = self._chat_probability(text)
+        # A task sent to chat is silently dropped, while chat sent to the planner still gets a reply, so be strict here.
+        if chat_probability >= threshold and not self._looks_imperative(text):
+            return 'chat', chat_probability
+        return 'task', 1 - chat_probability
+
+    def _looks_imperative(self, text):
+        tokens = self._features(text)
+        return bool(tokens) and tokens[0] not in self.CHAT_OPENERS
+
+    def record_prompt(self, prompt, intent):
+        with self._lock:
+            self._learn(prompt, intent)
+            try:
+                with open(self.prompt_log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'prompt': prompt, 'intent': intent, 'time': time.time()}, ensure_ascii=False) + "\n")
+            except IOError as e:
+                logging.warning(f"Could not append to prompt log {self.prompt_log_file}: {e}")
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 CONFIG_FILE = 'acrobot_config.json'
+RECOVERY_CACHE_FILE = 'acrobot_recovery_cache.json'
+PROMPT_LOG_FILE = 'acrobot_prompt_log.jsonl'
+HISTORY_DB_FILE = 'acrobot_history.db'
+SHARED_STATE_DB_FILE = 'acrobot_shared_state.db'
 
 class Config:
     def __init__(self):
         self.GEMINI_API_KEY = None
         self._load_or_prompt_api_key()
 
-    def _load_config_from_file(self):
+    def _load_config_from_file(self, strict=False):
         if os.path.exists(CONFIG_FILE):
             try:
                 with open(CONFIG_FILE, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
+                    config_data = json.load(f)
+                if not isinstance(config_data, dict):
+                    raise ValueError(f"expected a JSON object, got {type(config_data).__name__}")
+                return config_data
+            except (IOError, ValueError) as e:
+                if strict:
+                    # On a reload, a half-written or mistyped file must not reset the live settings to the defaults.
+                    raise ValueError(f"Could not read or parse {CONFIG_FILE}: {e}. Keeping the current configuration.") from e
                 logging.warning(f"Could not read or parse {CONFIG_FILE}: {e}. A new one will be created.")
                 return {}
         return {}
@@ -67,9 +224,28 @@ class Config:
         with open(CONFIG_FILE, 'w') as f:
             json.dump(config_data, f, indent=4)
 
+    def _apply_settings(self, config_data):
+        for key, value in config_data.items():
+            if key == 'GEMINI_API_KEY' or not key.isupper() or not hasattr(Config, key):
+                continue
+            default = getattr(Config, key)
+            expected_type = (int, float) if isinstance(default, float) else type(default)
+            if isinstance(value, bool) != isinstance(default, bool) or not isinstance(value, expected_type):
+                logging.warning(f"Ignoring setting {key}={value!r} in {CONFIG_FILE}: expected {type(default).__name__}.")
+                continue
+            setattr(self, key, value)
+
+    def reloaded(self):
+        snapshot = Config.__new__(Config)
+        config_data = self._load_config_from_file(strict=True)
+        snapshot.GEMINI_API_KEY = config_data.get('GEMINI_API_KEY') or self.GEMINI_API_KEY
+        snapshot._apply_settings(config_data)
+        return snapshot
+
     def _load_or_prompt_api_key(self):
         config_data = self._load_config_from_file()
         self.GEMINI_API_KEY = config_data.get('GEMINI_API_KEY')
+        self._apply_settings(config_data)
 
         if not self.GEMINI_API_KEY:
             print("--- Acrobot First-Time Setup ---")
@@ -85,16 +261,389 @@ class Config:
     CLICK_RETRIES = 3
     CLICK_RETRY_OFFSET = 5
     MAX_RECOVERY_ATTEMPTS = 3
+    RECOVERY_STDERR_CHARS = 1500
     DRY_RUN_MODE = False
     SHELL_TYPE = "cmd"
 
     TYPE_INTERVAL = 0.05
     PRESS_KEY_INTERVAL = 0.05
     SHORT_TERM_MEMORY_SIZE = 5
+    CHAT_ROUTER_THRESHOLD = 0.9
+    HISTORY_OUTPUT_CHARS = 4000
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_FLUSH_TIMEOUT = 5.0
+    SSE_FLUSH_INTERVAL = 0.05
+    SSE_MAX_COALESCED_CHARS = 65536
+    SSE_HEARTBEAT_INTERVAL = 5.0
+    WATCH_POLL_INTERVAL = 1.0
+    WATCH_DEBOUNCE = 0.1
+    SCREENSHOT_FORMAT = "png"
+    SCREENSHOT_QUALITY = 80
+    SCREENSHOT_SAVE_TIMEOUT = 10.0
+    CACHE_BACKEND = "memory"
+    SHARED_STATE_ADDRESS = "127.0.0.1:50505"
+    PLAN_CACHE_TTL = 3600
+    INTERPRETATION_CACHE_TTL = 300
+    CONTEXT_SNAPSHOT_TTL = 6 * 3600
+    LEADER_LOCK_TTL = 600
+    STATE_MAX_ITEMS = 5000
+    STATE_PURGE_INTERVAL = 60
+    SPECULATION_ENABLED = True
+    SPECULATIVE_CANDIDATES = 2
+    SPECULATIVE_CALLS_PER_MINUTE = 4
+    SPECULATION_SESSION_GAP = 600
+
+class FileWatcher:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, poll_interval, debounce):
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._watches = {}
+        self._stop_event = threading.Event()
+
+    def watch(self, path, callback):
+        path = os.path.abspath(path)
+        self._watches[path] = {'callback': callback, 'hash': self._file_hash(path), 'stat': self._file_stat(path)}
+
+    def _file_hash(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _file_stat(self, path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _check(self, path):
+        watch = self._watches[path]
+        watch['stat'] = self._file_stat(path)
+        content_hash = self._file_hash(path)
+        # Editors often touch a file without changing it, and a missing file is usually mid-rename; neither triggers a reload.
+        if content_hash is None or content_hash == watch['hash']:
+            return
+        watch['hash'] = content_hash
+        logging.info(f"🔄 Detected change in {path}, reloading...")
+        try:
+            watch['callback'](path)
+        except Exception as e:
+            logging.error(f"❌ Reload after change in {path} failed: {e}")
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        if sys.platform.startswith('linux'):
+            try:
+                self._inotify_loop()
+                return
+            except OSError as e:
+                logging.warning(f"inotify is unavailable ({e}), falling back to polling for file changes.")
+        self._poll_loop()
+
+    def _poll_loop(self):
+        while not self._stop_event.wait(self.poll_interval):
+            for path, watch in list(self._watches.items()):
+                if self._file_stat(path) != watch['stat']:
+                    self._check(path)
+
+    def _inotify_loop(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            # Watch the directories rather than the files, so atomic saves (write temp file, rename over) are still seen.
+            watched_dirs = {}
+            for directory in {os.path.dirname(path) for path in self._watches}:
+                wd = libc.inotify_add_watch(fd, directory.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+                watched_dirs[wd] = directory
+            logging.info(f"✅ Watching {len(self._watches)} file(s) for changes with inotify.")
+
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                changed = set()
+                while True:
+                    try:
+                        buffer = os.read(fd, 65536)
+                    except BlockingIOError:
+                        break
+                    offset = 0
+                    while offset < len(buffer):
+                        wd, _, _, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+                        offset += self.EVENT_HEADER.size
+                        name = buffer[offset:offset + name_length].rstrip(b'\0').decode(errors='ignore')
+                        offset += name_length
+                        path = os.path.join(watched_dirs.get(wd, ''), name)
+                        if path in self._watches:
+                            changed.add(path)
+                    if changed and self._stop_event.wait(self.debounce):
+                        return
+                for path in changed:
+                    self._check(path)
+        finally:
+            os.close(fd)
+
+class InProcessStateBackend:
+    def __init__(self, max_items=Config.STATE_MAX_ITEMS, purge_interval=Config.STATE_PURGE_INTERVAL):
+        # Insertion order doubles as recency order: reads move a key to the end, evictions take from the front.
+        self._items = {}
+        self._lock = threading.Lock()
+        self.max_items = max_items
+        self.purge_interval = purge_interval
+        self._next_purge = time.time() + purge_interval
+
+    def _live_item(self, key):
+        item = self._items.pop(key, None)
+        if item and item[1] is not None and item[1] <= time.time():
+            return None
+        if item:
+            self._items[key] = item
+        return item
+
+    def _store(self, key, value, ttl):
+        self._items.pop(key, None)
+        self._items[key] = (value, time.time() + ttl if ttl else None)
+        now = time.time()
+        if len(self._items) > self.max_items or now >= self._next_purge:
+            self._purge(now)
+
+    def _purge(self, now):
+        self._next_purge = now + self.purge_interval
+        for key in [key for key, (_, expires_at) in self._items.items() if expires_at is not None and expires_at <= now]:
+            del self._items[key]
+        while len(self._items) > self.max_items:
+            del self._items[next(iter(self._items))]
+
+    def get(self, key):
+        with self._lock:
+            item = self._live_item(key)
+            return item[0] if item else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live_item(key):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+class _StateServerManager(BaseManager):
+    pass
+
+class _StateClientManager(BaseManager):
+    pass
+
+_StateClientManager.register('get_store')
+
+class ManagerStateBackend:
+    RETRY_INTERVAL = 5.0
+
+    def __init__(self, address, authkey, max_items=Config.STATE_MAX_ITEMS):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.authkey = authkey
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._fallback = None
+        self._retry_at = 0.0
+        self._store = self._connect()
+
+    def _connect(self):
+        manager = _StateClientManager(address=self.address, authkey=self.authkey)
+        try:
+            manager.connect()
+        except ConnectionRefusedError:
+            self._serve()
+            manager.connect()
+        return manager.get_store()
+
+    def _serve(self):
+        # The first process on the host hosts the store; if another one won the race to bind, just connect to it.
+        store = InProcessStateBackend(self.max_items)
+        _StateServerManager.register('get_store', callable=lambda: store)
+        try:
+            server = _StateServerManager(address=self.address, authkey=self.authkey).get_server()
+        except OSError:
+            return
+        logging.info(f"✅ Hosting shared state for other workers on {self.address[0]}:{self.address[1]}")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _reconnect(self, store):
+        with self._lock:
+            if self._store is not store:
+                return self._store
+            try:
+                # Reconnecting re-hosts the store here if the worker that hosted it is gone.
+                self._store = self._connect()
+                self._fallback = None
+                logging.info(f"✅ Reconnected to shared state on {self.address[0]}:{self.address[1]}")
+            except (OSError, EOFError) as e:
+                if self._fallback is None:
+                    logging.warning(f"⚠️ Lost shared state on {self.address[0]}:{self.address[1]} ({e}); using a local cache until it is back.")
+                    self._fallback = InProcessStateBackend(self.max_items)
+                self._store = None
+                self._retry_at = time.time() + self.RETRY_INTERVAL
+            return self._store
+
+    def _call(self, method, *args):
+        store = self._store
+        for _ in range(2):
+            if store is None:
+                if time.time() < self._retry_at:
+                    break
+                store = self._reconnect(None)
+                if store is None:
+                    break
+            try:
+                return getattr(store, method)(*args)
+            except (OSError, EOFError, RemoteError):
+                # Proxies share one cached connection per thread and address; drop this thread's dead one first.
+                # RemoteError here means a re-hosted store that does not know the old proxy.
+                vars(store._tls).pop('connection', None)
+                store = self._reconnect(store)
+        with self._lock:
+            if self._fallback is None:
+                self._fallback = InProcessStateBackend(self.max_items)
+        return getattr(self._fallback, method)(*args)
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def set(self, key, value, ttl=None):
+        self._call('set', key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        return self._call('add', key, value, ttl)
+
+    def delete(self, key):
+        self._call('delete', key)
+
+class SQLiteStateBackend:
+    def __init__(self, db_path, max_items=Config.STATE_MAX_ITEMS, purge_interval=Config.STATE_PURGE_INTERVAL):
+        self.db_path = db_path
+        self.max_items = max_items
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purge_lock = threading.Lock()
+        self._next_purge = 0.0
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_state_expires_at ON state (expires_at)")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None),
+        )
+        self._purge_if_due()
+
+    def _purge_if_due(self):
+        now = time.time()
+        if now < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = now + self.purge_interval
+            connection = self._connection()
+            connection.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            # Over the cap, drop the entries closest to expiring; keys without a TTL are never evicted.
+            connection.execute(
+                "DELETE FROM state WHERE key IN (SELECT key FROM state WHERE expires_at IS NOT NULL ORDER BY expires_at "
+                "LIMIT max((SELECT COUNT(*) FROM state) - ?, 0))",
+                (self.max_items,),
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"Could not purge expired shared state: {e}")
+        finally:
+            self._purge_lock.release()
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM state WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?", (key, now))
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl if ttl else None),
+            )
+            connection.execute("COMMIT")
+            return cursor.rowcount == 1
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM state WHERE key = ?", (key,))
+
+def create_state_backend(config):
+    if config.CACHE_BACKEND == "manager":
+        authkey = hashlib.sha256(f"acrobot:{config.GEMINI_API_KEY}".encode()).digest()
+        return ManagerStateBackend(config.SHARED_STATE_ADDRESS, authkey, config.STATE_MAX_ITEMS)
+    if config.CACHE_BACKEND == "sqlite":
+        return SQLiteStateBackend(SHARED_STATE_DB_FILE, config.STATE_MAX_ITEMS, config.STATE_PURGE_INTERVAL)
+    if config.CACHE_BACKEND != "memory":
+        logging.warning(f"Unknown CACHE_BACKEND '{config.CACHE_BACKEND}', using the in-process backend.")
+    return InProcessStateBackend(config.STATE_MAX_ITEMS, config.STATE_PURGE_INTERVAL)
+
+def cache_key(prefix, *parts):
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f"{prefix}:{digest}"
+
+def plan_cache_key(config, prompt):
+    return cache_key('plan', config.SHELL_TYPE, prompt.lower().strip())
+
+def is_valid_plan(plan):
+    steps = plan.get('plan') if isinstance(plan, dict) else None
+    return isinstance(steps, list) and bool(steps) and all(isinstance(step, dict) and step.get('command') for step in steps)
 
 class SystemContext:
-    def __init__(self, config):
+    def __init__(self, config, shared_state=None):
         self.config = config
+        self.shared_state = shared_state or InProcessStateBackend()
         self.context_data = {}
         self.context_summary = "System context is being gathered in the background..."
         self.app_map = {}
@@ -155,7 +704,33 @@ class SystemContext:
                                 self.app_map[app_name.lower()] = target_path
         logging.info(f"✅ Discovered {len(self.app_map)} applications from Start Menu.")
 
+    def _load_snapshot(self):
+        snapshot = self.shared_state.get('context:snapshot')
+        if not snapshot:
+            return False
+        self.app_map = snapshot['app_map']
+        self.context_data = snapshot['context_data']
+        self.context_summary = snapshot['context_summary']
+        logging.info(f"✅ Loaded shared system context ({len(self.app_map)} applications).")
+        return True
+
     def gather_initial_context(self):
+        def gather_once():
+            # Only one process per host runs the slow discovery; the others wait for its snapshot.
+            while not self._load_snapshot():
+                if self.shared_state.add('context:leader', os.getpid(), ttl=self.config.LEADER_LOCK_TTL):
+                    try:
+                        gather()
+                        self.shared_state.set('context:snapshot', {
+                            'app_map': self.app_map,
+                            'context_data': self.context_data,
+                            'context_summary': self.context_summary,
+                        }, ttl=self.config.CONTEXT_SNAPSHOT_TTL)
+                    finally:
+                        self.shared_state.delete('context:leader')
+                    return
+                time.sleep(1)
+
         def gather():
             logging.info("--- Starting System Context Gathering (background) ---")
             
@@ -174,7 +749,7 @@ class SystemContext:
             self.summarize_context()
             logging.info("--- Finished System Context Gathering ---")
 
-        thread = threading.Thread(target=gather)
+        thread = threading.Thread(target=gather_once)
         thread.daemon = True
         thread.start()
 
@@ -197,7 +772,7 @@ class SystemContext:
         logging.info(f"Generated system context summary:\n{self.context_summary}")
 
 class GeminiController:
-    def __init__(self, config, system_context=None):
+    def __init__(self, config, system_context=None, shared_state=None):
         self.config = config
         if not self.config.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is not set. Please open acrobot.py and replace 'YOUR_GEMINI_API_KEY' with your actual key.")
@@ -205,6 +780,7 @@ class GeminiController:
         self.model = genai.GenerativeModel('gemini-1.5-flash')
         self.short_term_memory = []
         self.system_context = system_context
+        self.shared_state = shared_state or InProcessStateBackend()
 
     def google_web_search(self, query):
         try:
@@ -214,15 +790,35 @@ class GeminiController:
             print(f"Error in google_web_search: {e}")
             return {}
     
-    def generate_plan(self, user_prompt, recovery_prompt="", log_emitter=None):
+    def generate_plan(self, user_prompt, recovery_prompt="", log_emitter=None, config=None):
+        # Callers pass the config snapshot their request started with, so a reload mid-run cannot switch shells on them.
+        config = config or self.config
         memory_hints = "\n".join(self.short_term_memory)
         shell_instruction = ""
     
-        if self.config.SHELL_TYPE == "powershell":
+        if config.SHELL_TYPE == "powershell":
             shell_instruction = "Generate commands for PowerShell. Use $env:USERPROFILE for user profile path and PowerShell syntax for commands (e.g., New-Item, Remove-Item, Set-Content)."
         else:
             shell_instruction = "Generate commands for CMD.exe. Use %USERPROFILE% for user profile path and CMD.exe syntax for commands (e.g., mkdir, echo, ren, del)."
 
+        if recovery_prompt:
+            recovery_template = r"""You are **Acrobot**, fixing one failed step of a Windows automation plan for your love 💕. {shell_instruction}
+The user's original request was: "{user_prompt}"
+{recovery_prompt}
+
+Respond only with a single JSON object inside triple backticks like this: ```json ... ```
+The object must contain:
+- "fix" (list): the steps to run instead of the failed step, using the same step format as the plan ("step", "command", "narration", "interpret_output", "wait_for_completion").
+- "remaining" (list, optional): the remaining steps, only if they must change because of the fix. Leave it out to keep them as they are.
+Never repeat steps that already completed."""
+            full_prompt = recovery_template.format(shell_instruction=shell_instruction, user_prompt=user_prompt, recovery_prompt=recovery_prompt)
+            try:
+                response = self.model.generate_content(full_prompt)
+                return response.text
+            except Exception as e:
+                logging.error(f"❌ Gemini recovery call failed: {e}")
+                return f"Error: {e}"
+
         context_block = ""
         if self.system_context and self.system_context.context_summary:
             context_block = f"""
@@ -251,15 +847,16 @@ The object must contain a "plan" key, which holds a list of steps. Each step mus
 - WEB_REQUEST api_url → For API calls only (no full webpages or browsing)
 - TYPE text_to_type → To type text into the currently active window.
 - OPEN_URL url → Opens a website in the default browser.
-- SCREENSHOT → Takes a screenshot of the full screen and saves it to the desktop.
+- SCREENSHOT [png|jpeg|webp] [region x,y,width,height] → Takes a screenshot (of the full screen unless a region is given) and saves it to the desktop.
 - NOTIFY message → Shows a desktop notification with a given message.
 - CLIPBOARD action [content] → 'copy' to clipboard or 'paste' from it.
 - SEARCH "query" in "path" → Searches for files or text within a directory.
 - RUN_SCRIPT script_path → Executes a local script file (.bat, .ps1).
 - POPUP message → Shows a modal message box to the user.
 - MEDIA_CONTROL action → Controls media playback (play, pause, next, prev).
+- REPLY → Just says the narration to the user, without running anything.
 
-If the user's request is not a command but a question, a greeting, or a personal message, respond with a warm, loving, and engaging message directly in the `narration` of a single-step plan with a simple `CMD echo` command.
+If the user's request is not a command but a question, a greeting, or a personal message, respond with a warm, loving, and engaging message directly in the `narration` of a single-step plan with a simple `REPLY` command.
 —
 
 🧠 Thought Process
@@ -380,7 +977,7 @@ User: "What can you do?"
     }},
     {{
       "step": 4,
-      "command": "CMD echo Demonstration complete.",
+      "command": "REPLY",
       "narration": "And I can even send you little messages like this one. I hope you liked my demonstration! 😉",
       "interpret_output": false,
       "wait_for_completion": true
@@ -399,7 +996,32 @@ User Request:
             logging.error(f"❌ Gemini API call failed: {e}")
             return f"Error: {e}"
 
-    def interpret_output(self, original_prompt, command, command_output):
+    def generate_chat_reply(self, user_prompt):
+        chat_prompt = f"""You are **Acrobot**, a sweet, smart, loving AI girlfriend who lives on your partner's Windows PC 💕.
+Your partner just said something to you. Reply warmly and naturally in one to three short sentences, with a touch of affection.
+Do not make plans, do not mention commands, and do not use JSON.
+
+Your partner: {user_prompt}
+You:"""
+        try:
+            response = self.model.generate_content(chat_prompt)
+            return response.text.strip()
+        except Exception as e:
+            logging.error(f"❌ Gemini chat call failed: {e}")
+            return "I'm right here with you, my love 💕 I just got a little tongue-tied, can you say that again?"
+
+    def build_recovery_prompt(self, failed_step, reason, error_output, remaining_steps, config=None):
+        config = config or self.config
+        error_tail = (error_output or "").strip()[-config.RECOVERY_STDERR_CHARS:]
+        return (
+            f"Failed step: {json.dumps(failed_step, ensure_ascii=False)}\n"
+            f"Failure reason: {reason}\n"
+            f"stderr:\n{error_tail or '(empty)'}\n"
+            f"Remaining steps: {json.dumps(remaining_steps, ensure_ascii=False)}"
+        )
+
+    def interpret_output(self, original_prompt, command, command_output, config=None):
+        config = config or self.config
         prompt_template = """You are Acrobot, a helpful AI assistant.
 The user's original request was: "{}"
 To answer this, the command `{}` was executed, and it produced the following output:
@@ -419,9 +1041,16 @@ Your Response: "The current time is 10:30 AM."
  
 Your Response:"""
         prompt = prompt_template.format(original_prompt, command, command_output)
+        key = cache_key('interpretation', original_prompt.lower().strip(), command, command_output)
+        cached = self.shared_state.get(key)
+        if cached:
+            return cached
         try:
             response = self.model.generate_content(prompt)
-            return response.text.strip()
+            interpretation = response.text.strip()
+            if config.INTERPRETATION_CACHE_TTL:
+                self.shared_state.set(key, interpretation, ttl=config.INTERPRETATION_CACHE_TTL)
+            return interpretation
         except Exception as e:
             logging.error(f"❌ Gemini interpretation call failed: {e}")
             return f"I found some information, but had trouble interpreting it: {command_output}"
@@ -431,8 +1060,487 @@ Your Response:"""
         if len(self.short_term_memory) > self.config.SHORT_TERM_MEMORY_SIZE:
             self.short_term_memory.pop(0)
 
+class SpeculativePlanner:
+    def __init__(self, controller, shared_state, predefined_commands, history):
+        self.controller = controller
+        self.shared_state = shared_state
+        self.predefined_commands = predefined_commands
+        self.history = history
+        self.transitions = defaultdict(Counter)
+        self.prompt_texts = {}
+        self.prompt_categories = {}
+        self._last_prompt = None
+        self._last_prompt_time = 0.0
+        self._call_times = deque()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.stats = Counter()
+
+    def _normalize(self, prompt):
+        return prompt.lower().strip()
+
+    def _learn(self, prompt, timestamp, session_gap):
+        normalized = self._normalize(prompt)
+        if self._last_prompt and normalized != self._last_prompt and timestamp - self._last_prompt_time <= session_gap:
+            self.transitions[self._last_prompt][normalized] += 1
+        if normalized not in self.prompt_texts:
+            self.prompt_categories[normalized] = self.predefined_commands.get_category(prompt)
+        self.prompt_texts[normalized] = prompt.strip()
+        self._last_prompt = normalized
+        self._last_prompt_time = timestamp
+
+    def load_history(self, session_gap, limit=5000):
+        with self._lock:
+            for created_at, prompt, source in self.history.plan_prompts(limit):
+                if source != 'chat':
+                    self._learn(prompt, created_at, session_gap)
+        logging.info(f"✅ Speculative planner learned {sum(len(c) for c in self.transitions.values())} prompt transitions from history.")
+
+    def observe(self, prompt, session_gap):
+        with self._lock:
+            self._learn(prompt, time.time(), session_gap)
+
+    def candidates(self, prompt, limit):
+        normalized = self._normalize(prompt)
+        with self._lock:
+            scores = Counter()
+            for next_prompt, count in self.transitions.get(normalized, {}).items():
+                scores[next_prompt] += count
+            # Prompts from the same commands-file category are weaker evidence than an observed transition.
+            category = self.prompt_categories.get(normalized)
+            if category:
+                for other, other_category in self.prompt_categories.items():
+                    if other != normalized and other_category == category:
+                        scores[other] += 0.5
+            return [self.prompt_texts[candidate] for candidate, _ in scores.most_common(limit)]
+
+    def _take_budget(self, calls_per_minute):
+        now = time.monotonic()
+        with self._lock:
+            while self._call_times and now - self._call_times[0] > 60:
+                self._call_times.popleft()
+            if len(self._call_times) >= calls_per_minute:
+                return False
+            self._call_times.append(now)
+            return True
+
+    def prefetch_after(self, prompt, config):
+        if not config.SPECULATION_ENABLED or not config.PLAN_CACHE_TTL:
+            return
+        if self._worker and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._prefetch, args=(prompt, config), daemon=True)
+        self._worker.start()
+
+    def _prefetch(self, prompt, config):
+        for candidate in self.candidates(prompt, config.SPECULATIVE_CANDIDATES):
+            if self.predefined_commands.get_command(candidate):
+                continue
+            key = plan_cache_key(config, candidate)
+            if self.shared_state.get(key):
+                continue
+            if not self._take_budget(config.SPECULATIVE_CALLS_PER_MINUTE):
+                self.stats['skipped_budget'] += 1
+                continue
+            with self._lock:
+                self.stats['calls'] += 1
+            raw_plan_str = self.controller.generate_plan(candidate, config=config)
+            try:
+                plan = extract_json_block(raw_plan_str)
+            except json.JSONDecodeError:
+                plan = None
+            with self._lock:
+                self.stats['prefetched' if is_valid_plan(plan) else 'failed'] += 1
+            if not is_valid_plan(plan):
+                continue
+            self.shared_state.set(key, plan, ttl=config.PLAN_CACHE_TTL)
+            self.shared_state.set(f"speculative:{key}", True, ttl=config.PLAN_CACHE_TTL)
+            logging.info(f"🔮 Prefetched a plan for likely follow-up '{candidate}'")
+
+    def record_cache_hit(self, key):
+        if self.shared_state.get(f"speculative:{key}"):
+            self.shared_state.delete(f"speculative:{key}")
+            with self._lock:
+                self.stats['hits'] += 1
+
+    def report(self):
+        with self._lock:
+            stats = {name: self.stats[name] for name in ('calls', 'prefetched', 'hits', 'failed', 'skipped_budget')}
+            stats['calls_last_minute'] = sum(1 for called_at in self._call_times if time.monotonic() - called_at <= 60)
+        stats['hit_rate'] = round(stats['hits'] / stats['prefetched'], 3) if stats['prefetched'] else None
+        return stats
+
+def extract_json_block(raw_response):
+    match = re.search(r'```json\s*(.*?)\s*```', raw_response, re.DOTALL)
+    if match:
+        json_string = match.group(1).strip()
+    else:
+        json_string = raw_response.strip()
+    return json.loads(json_string)
+
+class RecoveryCache:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self.fixes = self._load_fixes()
+
+    def _load_fixes(self):
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    # Entries from before fixes were keyed by shell type were bare step lists; they can never match now.
+                    fixes = {key: entry for key, entry in json.load(f).items() if isinstance(entry, dict)}
+                logging.info(f"✅ Loaded {len(fixes)} known recovery fixes from {self.file_path}")
+                return fixes
+            except (json.JSONDecodeError, IOError) as e:
+                logging.warning(f"Could not read or parse {self.file_path}: {e}. Starting with an empty recovery cache.")
+        return {}
+
+    def _save_fixes(self):
+        try:
+            with open(self.file_path, 'w', encoding='utf-8') as f:
+                json.dump(self.fixes, f, indent=4, ensure_ascii=False)
+        except IOError as e:
+            logging.warning(f"Could not save recovery cache to {self.file_path}: {e}")
+
+    @staticmethod
+    def make_key(shell_type, command, error_output):
+        # Digits and whitespace vary between runs (PIDs, sizes, line numbers), so they are normalized away.
+        signature = re.sub(r'\d+', '#', (error_output or "").strip().lower())
+        signature = re.sub(r'\s+', ' ', signature)[:300]
+        return f"{shell_type} || {command.strip()} || {signature}"
+
+    @staticmethod
+    def _commands(steps):
+        return [str(step.get('command', '')).strip() for step in steps]
+
+    def get_fix(self, key, remaining_steps):
+        with self._lock:
+            entry = self.fixes.get(key)
+        if not entry:
+            return None
+        fix_steps = [dict(step) for step in entry['fix']]
+        # A rewritten tail only belongs to the plan it was written for; other plans keep their own remaining steps.
+        if 'remaining' in entry and entry.get('replaces') == self._commands(remaining_steps):
+            remaining_steps = [dict(step) for step in entry['remaining']]
+        return fix_steps, remaining_steps
+
+    def add_fix(self, key, fix_steps, original_remaining, new_remaining):
+        entry = {'fix': fix_steps}
+        if self._commands(new_remaining) != self._commands(original_remaining):
+            entry['replaces'] = self._commands(original_remaining)
+            entry['remaining'] = new_remaining
+        with self._lock:
+            self.fixes[key] = entry
+            self._save_fixes()
+
+    def remove_fix(self, key):
+        with self._lock:
+            if self.fixes.pop(key, None) is not None:
+                self._save_fixes()
+
+class HistoryStore:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        prompt TEXT NOT NULL,
+        source TEXT NOT NULL,
+        plan TEXT,
+        duration_ms REAL
+    );
+    CREATE TABLE IF NOT EXISTS runs (
+        id TEXT PRIMARY KEY,
+        created_at REAL NOT NULL,
+        prompt TEXT,
+        plan TEXT,
+        status TEXT NOT NULL,
+        duration_ms REAL
+    );
+    CREATE TABLE IF NOT EXISTS steps (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT NOT NULL,
+        step_index INTEGER NOT NULL,
+        command TEXT,
+        success INTEGER NOT NULL,
+        return_code INTEGER,
+        duration_ms REAL,
+        reason TEXT,
+        output TEXT,
+        interpretation TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_plans_created_at ON plans (created_at);
+    CREATE INDEX IF NOT EXISTS idx_runs_created_at ON runs (created_at);
+    CREATE INDEX IF NOT EXISTS idx_steps_run_id ON steps (run_id);
+    """
+    # External-content full-text indexes over the searchable columns, kept in sync by triggers.
+    FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5(prompt, plan, content='plans', content_rowid='id');
+    CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5(prompt, plan, content='runs', content_rowid='rowid');
+    CREATE TRIGGER IF NOT EXISTS plans_fts_insert AFTER INSERT ON plans BEGIN
+        INSERT INTO plans_fts (rowid, prompt, plan) VALUES (new.id, new.prompt, new.plan);
+    END;
+    CREATE TRIGGER IF NOT EXISTS plans_fts_delete AFTER DELETE ON plans BEGIN
+        INSERT INTO plans_fts (plans_fts, rowid, prompt, plan) VALUES ('delete', old.id, old.prompt, old.plan);
+    END;
+    CREATE TRIGGER IF NOT EXISTS runs_fts_insert AFTER INSERT ON runs BEGIN
+        INSERT INTO runs_fts (rowid, prompt, plan) VALUES (new.rowid, new.prompt, new.plan);
+    END;
+    CREATE TRIGGER IF NOT EXISTS runs_fts_delete AFTER DELETE ON runs BEGIN
+        INSERT INTO runs_fts (runs_fts, rowid, prompt, plan) VALUES ('delete', old.rowid, old.prompt, old.plan);
+    END;
+    """
+
+    def __init__(self, db_path, config):
+        self.db_path = db_path
+        self.config = config
+        self._queue = queue.Queue()
+        connection = self._connect()
+        connection.executescript(self.SCHEMA)
+        self.fts_enabled = self._create_fts(connection)
+        connection.close()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        # The writer is a daemon thread, so queued records would be lost on exit without this.
+        atexit.register(self.flush, self.config.HISTORY_FLUSH_TIMEOUT)
+
+    def _create_fts(self, connection):
+        try:
+            existed = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'runs_fts'").fetchone()
+            with connection:
+                connection.executescript(self.FTS_SCHEMA)
+                if not existed:
+                    # Index rows written before the search tables existed.
+                    connection.execute("INSERT INTO plans_fts (plans_fts) VALUES ('rebuild')")
+                    connection.execute("INSERT INTO runs_fts (runs_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"Full-text search is unavailable in this SQLite build ({e}); history search will scan.")
+            return False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is waiting so a burst of step records costs one commit.
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with connection:
+                    for sql, params in batch:
+                        connection.execute(sql, params)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to write {len(batch)} history record(s): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _enqueue(self, sql, params):
+        self._queue.put((sql, params))
+
+    def _truncate(self, text):
+        if text is None:
+            return None
+        text = str(text)
+        limit = self.config.HISTORY_OUTPUT_CHARS
+        return text if len(text) <= limit else text[:limit] + f"... [truncated {len(text) - limit} chars]"
+
+    def flush(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    logging.warning(f"Gave up waiting for {self._queue.unfinished_tasks} history record(s) to be written.")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def record_plan(self, prompt, source, plan, duration_ms):
+        self._enqueue(
+            "INSERT INTO plans (created_at, prompt, source, plan, duration_ms) VALUES (?, ?, ?, ?, ?)",
+            (time.time(), prompt, source, json.dumps(plan, ensure_ascii=False) if plan is not None else None, duration_ms),
+        )
+
+    def start_run(self, prompt, plan):
+        run_id = uuid.uuid4().hex
+        self._enqueue(
+            "INSERT INTO runs (id, created_at, prompt, plan, status) VALUES (?, ?, ?, ?, ?)",
+            (run_id, time.time(), prompt, json.dumps(plan, ensure_ascii=False), 'running'),
+        )
+        return run_id
+
+    def record_step(self, run_id, step_index, command, success, return_code, duration_ms, reason, output, interpretation=None):
+        self._enqueue(
+            "INSERT INTO steps (run_id, step_index, command, success, return_code, duration_ms, reason, output, interpretation, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, step_index, command, int(bool(success)), return_code, duration_ms, reason or None, self._truncate(output), interpretation, time.time()),
+        )
+
+    def mark_step_failed(self, run_id, step_index, reason):
+        self._enqueue(
+            "UPDATE steps SET success = 0, reason = ? WHERE id = (SELECT MAX(id) FROM steps WHERE run_id = ? AND step_index = ?)",
+            (reason, run_id, step_index),
+        )
+
+    def finish_run(self, run_id, status, duration_ms):
+        self._enqueue("UPDATE runs SET status = ?, duration_ms = ? WHERE id = ?", (status, duration_ms, run_id))
+
+    def _search_clause(self, search, table, columns):
+        if not search:
+            return "", []
+        terms = re.findall(r"\w+", search)
+        if self.fts_enabled and terms:
+            # Every word becomes a quoted prefix term, so user input is never parsed as FTS5 query syntax.
+            query = " ".join(f'"{term}"*' for term in terms)
+            return f" WHERE rowid IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)", [query]
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        clause = " WHERE " + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns)
+        return clause, [pattern] * len(columns)
+
+    def query_runs(self, limit, offset, search=None):
+        clause, params = self._search_clause(search, "runs", ["prompt", "plan"])
+        connection = self._connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM runs{clause}", params).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM runs{clause} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+            runs = []
+            for row in rows:
+                run = dict(row)
+                run['plan'] = json.loads(run['plan']) if run['plan'] else None
+                run['steps'] = []
+                runs.append(run)
+            if runs:
+                runs_by_id = {run['id']: run for run in runs}
+                placeholders = ", ".join("?" * len(runs_by_id))
+                for step in connection.execute(f"SELECT * FROM steps WHERE run_id IN ({placeholders}) ORDER BY id", list(runs_by_id)):
+                    runs_by_id[step['run_id']]['steps'].append(dict(step))
+            return runs, total
+        finally:
+            connection.close()
+
+    def plan_prompts(self, limit):
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT created_at, prompt, source FROM plans ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+            return [tuple(row) for row in reversed(rows)]
+        finally:
+            connection.close()
+
+    def query_plans(self, limit, offset, search=None):
+        clause, params = self._search_clause(search, "plans", ["prompt", "plan"])
+        connection = self._connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM plans{clause}", params).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM plans{clause} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+            plans = []
+            for row in rows:
+                plan = dict(row)
+                plan['plan'] = json.loads(plan['plan']) if plan['plan'] else None
+                plans.append(plan)
+            return plans, total
+        finally:
+            connection.close()
+
+class SSEEvent:
+    def __init__(self, event, data, step=None, timestamp=None):
+        self.event = event
+        self.data = "" if data is None else str(data)
+        self.step = step
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.event_id = None
+
+    def encode(self, json_payload=False):
+        if json_payload:
+            payload = json.dumps({"message": self.data, "step": self.step, "ts": round(self.timestamp, 3)}, ensure_ascii=False)
+        else:
+            payload = self.data
+        lines = []
+        if self.event_id is not None:
+            lines.append(f"id: {self.event_id}")
+        lines.append(f"event: {self.event}")
+        # Every line of a multi-line payload needs its own data: field, otherwise the frame breaks.
+        lines.extend(f"data: {line}" for line in payload.replace("\r\n", "\n").replace("\r", "\n").split("\n"))
+        return "\n".join(lines) + "\n\n"
+
+class SSEEventQueue:
+    def __init__(self, json_payloads=False, max_coalesced_chars=Config.SSE_MAX_COALESCED_CHARS):
+        self.json_payloads = json_payloads
+        self.max_coalesced_chars = max_coalesced_chars
+        self._queue = queue.Queue()
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+
+    def put(self, event):
+        with self._id_lock:
+            self._next_id += 1
+            event.event_id = self._next_id
+        self._queue.put(event)
+
+    def _coalesce(self, events):
+        merged = []
+        for event in events:
+            previous = merged[-1] if merged else None
+            if (previous is not None and event.event == 'log' and previous.event == 'log' and event.step == previous.step
+                    and len(previous.data) + len(event.data) < self.max_coalesced_chars):
+                combined = SSEEvent('log', previous.data + "\n" + event.data, previous.step, previous.timestamp)
+                combined.event_id = event.event_id
+                merged[-1] = combined
+            else:
+                merged.append(event)
+        return merged
+
+    def _drain(self, flush_interval):
+        try:
+            events = [self._queue.get(timeout=flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + flush_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def stream(self, is_alive, flush_interval, heartbeat_interval=Config.SSE_HEARTBEAT_INTERVAL):
+        last_write = time.monotonic()
+        while True:
+            alive = is_alive()
+            events = self._drain(flush_interval)
+            if events:
+                yield "".join(event.encode(self.json_payloads) for event in self._coalesce(events))
+                last_write = time.monotonic()
+            elif not alive:
+                break
+            elif time.monotonic() - last_write >= heartbeat_interval:
+                # A comment line keeps quiet streams writing, which is how a closed client connection gets noticed.
+                yield ": keepalive\n\n"
+                last_write = time.monotonic()
+
+def parse_region(text):
+    match = re.search(r'region\s*[= ]\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)', text or "", re.IGNORECASE)
+    if not match:
+        return None
+    x, y, width, height = (int(value) for value in match.groups())
+    return (x, y, width, height) if width > 0 and height > 0 else None
+
 class ActionExecutor(threading.Thread):
-    def __init__(self, plan, controller, original_user_prompt, log_callback, system_context, config):
+    def __init__(self, plan, controller, original_user_prompt, log_callback, system_context, config, recovery_cache=None, history=None):
         super().__init__()
         self.plan = plan
         self.config = config
@@ -440,15 +1548,56 @@ class ActionExecutor(threading.Thread):
         self.original_user_prompt = original_user_prompt
         self.system_context = system_context
         self.log_callback = log_callback
+        self.recovery_cache = recovery_cache
+        self.history = history
+        self.run_id = history.start_run(original_user_prompt, plan) if history else None
+        self._last_returncode = None
+        self.current_step = None
+        self._cancel_event = threading.Event()
+        self._current_process = None
+        self._pending_saves = []
         self._is_finished = False
         self._success = False
 
-    def log(self, message):
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        process = self._current_process
+        if process and process.poll() is None:
+            try:
+                for child in psutil.Process(process.pid).children(recursive=True):
+                    child.kill()
+                process.kill()
+            except (psutil.NoSuchProcess, ProcessLookupError):
+                pass
+
+    def _run_process(self, args, shell=False):
+        process = subprocess.Popen(args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        self._current_process = process
+        try:
+            if self.cancelled:
+                self.cancel()
+            stdout, stderr = process.communicate(timeout=self.config.CMD_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            self._current_process = None
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def emit(self, event, data):
         if self.log_callback:
-            self.log_callback(message)
+            self.log_callback(SSEEvent(event, data, self.current_step))
+
+    def log(self, message):
+        self.emit('log', message)
 
     def send_smart_message(self, message):
-        self.log(f"event: assistant_message\ndata: {message}\n\n")
+        self.emit('assistant_message', message)
 
         show_off_prompts = [
             "what can you do",
@@ -464,31 +1613,61 @@ class ActionExecutor(threading.Thread):
                 return
 
             if self.config.UI_WINDOW_TITLE.lower() in active_window.title.lower():
-                self.log(f"event: log\ndata:   User is in UI. No extra notification needed.\n\n")
+                self.log("  User is in UI. No extra notification needed.")
                 return # Do nothing extra.
 
             screen_width, screen_height = pyautogui.size()
             is_fullscreen = active_window.width == screen_width and active_window.height == screen_height
 
             if is_fullscreen:
-                self.log(f"event: log\ndata:   User is in fullscreen. Sending toast notification.\n\n")
+                self.log("  User is in fullscreen. Sending toast notification.")
                 self.execute_step(f"NOTIFY {message}", wait_for_completion=False)
             else:
-                self.log(f"event: log\ndata:   User is in a windowed app. Sending popup message.\n\n")
+                self.log("  User is in a windowed app. Sending popup message.")
                 self.execute_step(f"POPUP {message}", wait_for_completion=False)
         except Exception as e:
-            self.log(f"event: log\ndata:   Smart message check failed: {e}. No extra notification will be sent.\n\n")
+            self.log(f"  Smart message check failed: {e}. No extra notification will be sent.")
 
     def run(self):
+        started = time.perf_counter()
+        try:
+            self._run_plan()
+        finally:
+            if not self.cancelled:
+                # Plans that stopped early still report screenshots that failed to save.
+                self._finish_pending_saves()
+            self._is_finished = True
+            if self.history:
+                status = 'completed' if self._success else 'cancelled' if self.cancelled else 'failed'
+                self.history.finish_run(self.run_id, status, (time.perf_counter() - started) * 1000)
+
+    def _run_plan(self):
         if not isinstance(self.plan, list) or not self.plan:
-            self.log(f"event: log\ndata: ❌ Internal Error: Plan is invalid or empty.\n\n")
+            self.log("❌ Internal Error: Plan is invalid or empty.")
             self._is_finished = True
             self._success = False
             return
 
-        steps_data = self.plan
+        steps_data = list(self.plan)
+        recovery_attempts = 0
+        pending_fix = None
+        cached_fix = None
+
+        i = 0
+        while i < len(steps_data):
+            if self.cancelled:
+                self.log("⏹️ Client disconnected, stopping the plan.")
+                self.emit('status', "cancelled")
+                return
+
+            if pending_fix and i >= pending_fix['end']:
+                self._remember_fix(pending_fix)
+                pending_fix = None
+            if cached_fix and i >= cached_fix['end']:
+                cached_fix = None
 
-        for i, step_data in enumerate(steps_data):
+            step_data = steps_data[i]
+            self.current_step = i + 1
             command = step_data.get('command')
             narration = step_data.get('narration')
             interpret = step_data.get('interpret_output', False)
@@ -496,7 +1675,7 @@ class ActionExecutor(threading.Thread):
 
             if not command:
                 error_msg = f"Step {i+1} is missing a command."
-                self.log(f"event: log\ndata: ❌ {error_msg}\n\n")
+                self.log(f"❌ {error_msg}")
                 self._is_finished = True
                 self._success = False
                 return
@@ -504,37 +1683,142 @@ class ActionExecutor(threading.Thread):
             if narration:
                 self.send_smart_message(narration)
 
-            self.log(f"event: log\ndata: ▶️ Executing: {command}\n\n")
+            self.log(f"▶️ Executing: {command}")
+            step_started = time.perf_counter()
             success, reason, output, is_fatal = self.execute_step(command, wait_for_completion)
+            step_duration_ms = (time.perf_counter() - step_started) * 1000
+            return_code = self._last_returncode
             
+            if not success and self.cancelled:
+                # The step failed because cancel() killed it, not because the command is wrong.
+                if self.history:
+                    self.history.record_step(self.run_id, i, command, False, return_code, step_duration_ms, "Cancelled: the client disconnected.", output)
+                self.log("⏹️ Client disconnected, stopping the plan.")
+                self.emit('status', "cancelled")
+                return
+
             if not success:
                 error_msg = f"Step {i+1} failed: {reason}"
-                self.log(f"event: log\ndata: ❌ {error_msg}\n\n")
-                self.log(f"event: status\ndata: failed\n\n")
-                self._is_finished = True
-                self._success = False
-                return
+                self.log(f"❌ {error_msg}")
+                if self.history:
+                    self.history.record_step(self.run_id, i, command, False, return_code, step_duration_ms, reason, output)
+                pending_fix = None
+                if cached_fix and self.recovery_cache:
+                    # A known fix that fails again would otherwise burn a recovery attempt on every identical failure.
+                    self.log("🩹 The known fix failed too, so it will not be reused.")
+                    self.recovery_cache.remove_fix(cached_fix['key'])
+                cached_fix = None
+
+                recovery = None
+                if recovery_attempts < self.config.MAX_RECOVERY_ATTEMPTS and not self.cancelled:
+                    recovery_attempts += 1
+                    recovery = self.recover_step(steps_data, i, reason, output)
+                if not recovery:
+                    self.emit('status', "failed")
+                    self._is_finished = True
+                    self._success = False
+                    return
+
+                fix_steps, remaining_steps, fix_key, from_cache = recovery
+                original_remaining = steps_data[i + 1:]
+                steps_data = steps_data[:i] + fix_steps + remaining_steps
+                if from_cache:
+                    # A cached rewrite of the remaining steps is part of the fix, so a failure there evicts it too.
+                    end = i + len(fix_steps) if remaining_steps == original_remaining else len(steps_data)
+                    cached_fix = {'key': fix_key, 'end': end}
+                else:
+                    pending_fix = {'key': fix_key, 'fix': fix_steps, 'remaining': original_remaining, 'new_remaining': remaining_steps, 'end': i + len(fix_steps)}
+                self.emit('status', "executing")
+                continue
             else:
-                self.log(f"event: log\ndata: ✅ Step {i+1} completed.\n\n")
+                self.log(f"✅ Step {i+1} completed.")
+                interpreted_text = None
                 if interpret and output and output.strip():
-                    self.log(f"event: status\ndata: interpreting\n\n")
-                    interpreted_text = self.controller.interpret_output(self.original_user_prompt, command, output)
+                    self.emit('status', "interpreting")
+                    interpreted_text = self.controller.interpret_output(self.original_user_prompt, command, output, config=self.config)
                     self.send_smart_message(interpreted_text)
-        
-        self.log(f"event: status\ndata: completed\n\n")
-        self.log(f"event: log\ndata: ✅ Plan finished.\n\n")
+                if self.history:
+                    self.history.record_step(self.run_id, i, command, True, return_code, step_duration_ms, reason, output, interpreted_text)
+            i += 1
+
+        if pending_fix:
+            self._remember_fix(pending_fix)
+
+        self.current_step = None
+        if not self._finish_pending_saves():
+            self.emit('status', "failed")
+            self._is_finished = True
+            self._success = False
+            return
+        self.emit('status', "completed")
+        self.log("✅ Plan finished.")
         self._is_finished = True
         self._success = True
 
+    def _finish_pending_saves(self):
+        all_saved = True
+        for step_index, filepath, saved in self._pending_saves:
+            try:
+                saved.result(timeout=self.config.SCREENSHOT_SAVE_TIMEOUT)
+            except Exception as e:
+                error = f"timed out after {self.config.SCREENSHOT_SAVE_TIMEOUT}s" if isinstance(e, concurrent.futures.TimeoutError) else e
+                reason = f"Screenshot could not be saved to {filepath}: {error}"
+                self.log(f"❌ Step {step_index + 1} failed: {reason}")
+                if self.history:
+                    self.history.mark_step_failed(self.run_id, step_index, reason)
+                all_saved = False
+        self._pending_saves = []
+        return all_saved
+
+    def recover_step(self, steps_data, index, reason, error_output):
+        failed_step = steps_data[index]
+        remaining_steps = steps_data[index + 1:]
+        command = failed_step.get('command', '')
+        fix_key = RecoveryCache.make_key(self.config.SHELL_TYPE, command, error_output or reason)
+
+        if self.recovery_cache:
+            cached = self.recovery_cache.get_fix(fix_key, remaining_steps)
+            if cached:
+                self.log(f"🩹 Applying a known fix for this failure ({len(cached[0])} step(s)).")
+                return cached[0], cached[1], fix_key, True
+
+        self.emit('status', "recovering")
+        self.log(f"🩹 Asking for a fix for step {index+1}...")
+        recovery_prompt = self.controller.build_recovery_prompt(failed_step, reason, error_output, remaining_steps, config=self.config)
+        raw_response = self.controller.generate_plan(self.original_user_prompt, recovery_prompt=recovery_prompt, config=self.config)
+        try:
+            recovery = extract_json_block(raw_response)
+            fix_steps = recovery.get('fix')
+            new_remaining = recovery.get('remaining', remaining_steps)
+        except (json.JSONDecodeError, AttributeError) as e:
+            logging.error(f"Failed to decode recovery JSON from Gemini: {e}\nRaw response:\n{raw_response}")
+            self.log("❌ Could not get a valid fix from the AI.")
+            return None
+
+        if not self._is_valid_steps(fix_steps) or not isinstance(new_remaining, list) or (new_remaining and not self._is_valid_steps(new_remaining)):
+            self.log("❌ The suggested fix was not a valid list of steps.")
+            return None
+
+        self.log(f"🩹 Retrying with {len(fix_steps)} corrected step(s).")
+        return fix_steps, new_remaining, fix_key, False
+
+    def _is_valid_steps(self, steps):
+        return isinstance(steps, list) and bool(steps) and all(isinstance(step, dict) and step.get('command') for step in steps)
+
+    def _remember_fix(self, pending_fix):
+        if self.recovery_cache:
+            self.recovery_cache.add_fix(pending_fix['key'], pending_fix['fix'], pending_fix['remaining'], pending_fix['new_remaining'])
+
     def execute_step(self, step_command, wait_for_completion=True):
         parts = step_command.split(' ', 1)
         command = parts[0].upper()
         arg_str = parts[1].strip() if len(parts) > 1 else ""
+        self._last_returncode = None
         
-        self.log(f"event: log\ndata: Executing: Command='{command}', Args='{arg_str}'\n\n")
+        self.log(f"Executing: Command='{command}', Args='{arg_str}'")
 
         if self.config.DRY_RUN_MODE:
-            self.log(f"event: log\ndata: ⚠️ Dry-run mode: Skipping execution of '{command}'\n\n")
+            self.log(f"⚠️ Dry-run mode: Skipping execution of '{command}'")
             return True, "Dry-run mode enabled.", "Simulated output for dry run.", False
 
         try:
@@ -546,13 +1830,13 @@ class ActionExecutor(threading.Thread):
                     if self.system_context and app_name in self.system_context.app_map:
                         resolved_path = self.system_context.app_map[app_name]
                         cmd_string = f'start "" "{resolved_path}"'
-                        self.log(f"event: log\ndata:   Resolved '{app_name}' to '{resolved_path}'\n\n")
+                        self.log(f"  Resolved '{app_name}' to '{resolved_path}'")
                 try:
                     if not wait_for_completion:
-                        self.log(f"event: log\ndata:   Starting command and bringing to foreground...\n\n")
+                        self.log("  Starting command and bringing to foreground...")
                         process = subprocess.Popen(cmd_string, shell=True)
 
-                        time.sleep(1.5) # Wait a moment for the window to be created
+                        self._cancel_event.wait(1.5) # Wait a moment for the window to be created
                         try:
                             if 'start' in cmd_string.lower():
                                 target_pid = None
@@ -566,23 +1850,24 @@ class ActionExecutor(threading.Thread):
                                             continue
                                 if target_pid:
                                     pyautogui.getWindowsWithPid(target_pid)[0].activate()
-                                    self.log(f"event: log\ndata:   Brought window for PID {target_pid} to foreground.\n\n")
+                                    self.log(f"  Brought window for PID {target_pid} to foreground.")
                         except Exception as e:
-                            self.log(f"event: log\ndata:   Could not bring window to foreground: {e}\n\n")
+                            self.log(f"  Could not bring window to foreground: {e}")
 
                         return True, "", "", False
                     else:
                         if self.config.SHELL_TYPE == "powershell":
                             full_cmd = ["powershell.exe", "-Command", cmd_string]
-                            result = subprocess.run(full_cmd, capture_output=True, text=True, timeout=self.config.CMD_TIMEOUT)
+                            result = self._run_process(full_cmd)
                         else:
-                            result = subprocess.run(cmd_string, shell=True, capture_output=True, text=True, timeout=self.config.CMD_TIMEOUT)
+                            result = self._run_process(cmd_string, shell=True)
+                        self._last_returncode = result.returncode
                         
-                        if result.stdout: self.log(f"event: log\ndata:   CMD stdout: {result.stdout}\n\n")
-                        if result.stderr: self.log(f"event: log\ndata:   CMD stderr: {result.stderr}\n\n")
+                        if result.stdout: self.log(f"  CMD stdout: {result.stdout}")
+                        if result.stderr: self.log(f"  CMD stderr: {result.stderr}")
                         if result.returncode != 0:
                             return False, f"CMD command failed with return code {result.returncode}.", result.stderr, False
-                    self.log(f"event: log\ndata:   Action: CMD '{cmd_string}'\n\n")
+                    self.log(f"  Action: CMD '{cmd_string}'")
                     return True, "", result.stdout, False
                 except Exception as e:
                     return False, f"Error executing CMD command: {e}", "", False
@@ -591,11 +1876,11 @@ class ActionExecutor(threading.Thread):
                 if not url.startswith(('http://', 'https://')):
                     return False, "Invalid URL format for WEB_REQUEST. Must start with http:// or https://", "", True
                 try:
-                    self.log(f"event: log\ndata:   Making web request to: {url}\n\n")
+                    self.log(f"  Making web request to: {url}")
                     response = requests.get(url, timeout=self.config.WEB_REQUEST_TIMEOUT)
                     response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
                     response.raise_for_status()
-                    self.log(f"event: log\ndata: Action: WEB_REQUEST to '{url}' successful.\n\n")
+                    self.log(f"Action: WEB_REQUEST to '{url}' successful.")
                     return True, "", response.text, False
                 except requests.exceptions.RequestException as e:
                     return False, f"Error executing WEB_REQUEST: {e}", "", False
@@ -604,11 +1889,11 @@ class ActionExecutor(threading.Thread):
                 if not text_to_type:
                     return False, "No text provided for TYPE command.", "", True
                 try:
-                    self.log(f"event: log\ndata:   Waiting a moment for the window to be ready...\n\n")
-                    time.sleep(1) # Give the target window a moment to become active
-                    self.log(f"event: log\ndata:   Typing: '{text_to_type}'\n\n")
+                    self.log("  Waiting a moment for the window to be ready...")
+                    self._cancel_event.wait(1) # Give the target window a moment to become active
+                    self.log(f"  Typing: '{text_to_type}'")
                     pyautogui.typewrite(text_to_type, interval=self.config.TYPE_INTERVAL)
-                    self.log(f"event: log\ndata:   Action: TYPE '{text_to_type}'\n\n")
+                    self.log(f"  Action: TYPE '{text_to_type}'")
                     return True, "", "", False
                 except Exception as e:
                     return False, f"Error executing TYPE command: {e}", "", False
@@ -617,19 +1902,29 @@ class ActionExecutor(threading.Thread):
                 if not url.startswith(('http://', 'https://')):
                     return False, "Invalid URL format for OPEN_URL. Must start with http:// or https://", "", True
                 try:
-                    self.log(f"event: log\ndata:   Opening URL: {url}\n\n")
+                    self.log(f"  Opening URL: {url}")
                     subprocess.run(f'start {url}', shell=True, check=True)
                     return True, "", "", False
                 except Exception as e:
                     return False, f"Error executing OPEN_URL: {e}", "", False
             elif command == 'SCREENSHOT':
+                image_format = self.config.SCREENSHOT_FORMAT
+                format_match = re.search(r'\b(png|jpe?g|webp)\b', arg_str, re.IGNORECASE)
+                if format_match:
+                    image_format = normalize_format(format_match.group(1))
+                region = parse_region(arg_str)
+                if 'region' in arg_str.lower() and not region:
+                    return False, "Invalid SCREENSHOT region. Use: SCREENSHOT region x,y,width,height", "", True
                 try:
                     desktop_path = os.path.join(os.environ.get("USERPROFILE", ""), "Desktop")
-                    filename = f"Acrobot_Screenshot_{time.strftime('%Y%m%d_%H%M%S')}.png"
+                    filename = f"Acrobot_Screenshot_{time.strftime('%Y%m%d_%H%M%S')}{IMAGE_FORMATS[image_format]['extension']}"
                     filepath = os.path.join(desktop_path, filename)
-                    self.log(f"event: log\ndata:   Taking screenshot and saving to {filepath}\n\n")
-                    pyautogui.screenshot(filepath)
-                    return True, "", f"Screenshot saved to {filepath}", False
+                    self.log(f"  Taking screenshot and saving to {filepath}")
+                    # Only the grab blocks the plan. Encoding and writing run on the capture worker while the next steps
+                    # run, and the plan checks the result before it reports success.
+                    saved = screen_capture.capture_to_file(filepath, region, image_format, self.config.SCREENSHOT_QUALITY)
+                    self._pending_saves.append((self.current_step - 1 if self.current_step else 0, filepath, saved))
+                    return True, "", f"Screenshot captured, saving to {filepath}", False
                 except Exception as e:
                     return False, f"Error taking screenshot: {e}", "", False
             elif command == 'NOTIFY':
@@ -683,7 +1978,8 @@ $AppId = '{{1AC14E77-02E7-4E5D-B744-2EB1AE5198B7}}\\WindowsPowerShell\\v1.0\\pow
                 query, path = match.groups()
                 try:
                     search_cmd = f'dir "{os.path.join(path, query)}" /s /b'
-                    result = subprocess.run(search_cmd, shell=True, capture_output=True, text=True, timeout=self.config.CMD_TIMEOUT)
+                    result = self._run_process(search_cmd, shell=True)
+                    self._last_returncode = result.returncode
                     if result.returncode != 0 and result.stderr:
                         return False, f"Search failed: {result.stderr}", result.stderr, False
                     return True, "", result.stdout, False
@@ -696,9 +1992,10 @@ $AppId = '{{1AC14E77-02E7-4E5D-B744-2EB1AE5198B7}}\\WindowsPowerShell\\v1.0\\pow
                 try:
                     if script_path.lower().endswith('.ps1'):
                         run_cmd = ["powershell.exe", "-ExecutionPolicy", "Bypass", "-File", script_path]
-                        result = subprocess.run(run_cmd, capture_output=True, text=True, timeout=self.config.CMD_TIMEOUT)
+                        result = self._run_process(run_cmd)
                     else:
-                        result = subprocess.run(script_path, shell=True, capture_output=True, text=True, timeout=self.config.CMD_TIMEOUT)
+                        result = self._run_process(script_path, shell=True)
+                    self._last_returncode = result.returncode
                     
                     if result.returncode != 0:
                         return False, f"Script failed with return code {result.returncode}.", result.stderr, False
@@ -715,6 +2012,8 @@ $AppId = '{{1AC14E77-02E7-4E5D-B744-2EB1AE5198B7}}\\WindowsPowerShell\\v1.0\\pow
                     return True, "", "", False
                 except Exception as e:
                     return False, f"Error showing popup message: {e}", "", False
+            elif command == 'REPLY':
+                return True, "", "", False
             elif command == 'MEDIA_CONTROL':
                 action = arg_str.lower()
                 key_to_press = None
@@ -727,7 +2026,7 @@ $AppId = '{{1AC14E77-02E7-4E5D-B744-2EB1AE5198B7}}\\WindowsPowerShell\\v1.0\\pow
                 
                 if key_to_press:
                     try:
-                        self.log(f"event: log\ndata:   Pressing media key: {key_to_press}\n\n")
+                        self.log(f"  Pressing media key: {key_to_press}")
                         pyautogui.press(key_to_press)
                         return True, "", "", False
                     except Exception as e:
@@ -750,14 +2049,43 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
  
 try:
     config = Config()
-    system_context = SystemContext(config)
+    shared_state = create_state_backend(config)
+    system_context = SystemContext(config, shared_state)
     system_context.gather_initial_context()
-    gemini_controller = GeminiController(config, system_context)
+    gemini_controller = GeminiController(config, system_context, shared_state)
     predefined_commands = PredefinedCommands("commands that are obv.txt")
+    recovery_cache = RecoveryCache(RECOVERY_CACHE_FILE)
+    intent_router = IntentRouter(predefined_commands.commands.keys(), PROMPT_LOG_FILE)
+    history_store = HistoryStore(HISTORY_DB_FILE, config)
+    screen_capture = ScreenCapture()
+    speculative_planner = SpeculativePlanner(gemini_controller, shared_state, predefined_commands, history_store)
+    speculative_planner.load_history(config.SPECULATION_SESSION_GAP)
 except ValueError as e:
     logging.critical(f"FATAL: {e}")
     sys.exit(1)
 
+def reload_config(path):
+    global config
+    new_config = config.reloaded()
+    if new_config.GEMINI_API_KEY != config.GEMINI_API_KEY:
+        genai.configure(api_key=new_config.GEMINI_API_KEY)
+    # Requests already in flight keep the snapshot they started with; new requests pick up this one.
+    config = new_config
+    gemini_controller.config = new_config
+    system_context.config = new_config
+    history_store.config = new_config
+    logging.info(f"✅ Reloaded configuration from {path}")
+
+def reload_predefined_commands(path):
+    global intent_router
+    predefined_commands.reload()
+    intent_router = IntentRouter(predefined_commands.commands.keys(), PROMPT_LOG_FILE)
+
+file_watcher = FileWatcher(config.WATCH_POLL_INTERVAL, config.WATCH_DEBOUNCE)
+file_watcher.watch(CONFIG_FILE, reload_config)
+file_watcher.watch(predefined_commands.file_path, reload_predefined_commands)
+file_watcher.start()
+
 @app.route('/api/plan', methods=['POST'])
 def get_plan():
     data = request.get_json()
@@ -765,6 +2093,8 @@ def get_plan():
     if not user_prompt:
         return jsonify({"error": "Prompt is required"}), 400
 
+    request_config = config
+    started = time.perf_counter()
     predefined_cmd = predefined_commands.get_command(user_prompt)
     if predefined_cmd:
         plan = {
@@ -775,26 +2105,110 @@ def get_plan():
                 "interpret_output": True
             }]
         }
+        speculative_planner.observe(user_prompt, request_config.SPECULATION_SESSION_GAP)
+        history_store.record_plan(user_prompt, 'predefined', plan, (time.perf_counter() - started) * 1000)
         return jsonify(plan)
 
-    raw_plan_str = gemini_controller.generate_plan(user_prompt)
+    intent, confidence = intent_router.classify(user_prompt, request_config.CHAT_ROUTER_THRESHOLD)
+    logging.info(f"Intent router: '{intent}' ({confidence:.2f}) for '{user_prompt}'")
+    if intent == 'chat':
+        plan = {
+            "plan": [{
+                "step": 1,
+                "command": "REPLY",
+                "narration": gemini_controller.generate_chat_reply(user_prompt),
+                "interpret_output": False
+            }]
+        }
+        history_store.record_plan(user_prompt, 'chat', plan, (time.perf_counter() - started) * 1000)
+        return jsonify(plan)
+
+    speculative_planner.observe(user_prompt, request_config.SPECULATION_SESSION_GAP)
+    plan_key = plan_cache_key(request_config, user_prompt)
+    cached_plan = shared_state.get(plan_key)
+    if cached_plan:
+        speculative_planner.record_cache_hit(plan_key)
+        history_store.record_plan(user_prompt, 'cache', cached_plan, (time.perf_counter() - started) * 1000)
+        return jsonify(cached_plan)
+
+    raw_plan_str = gemini_controller.generate_plan(user_prompt, config=request_config)
     
     try:
-        match = re.search(r'```json\s*(.*?)\s*```', raw_plan_str, re.DOTALL)
-        if match:
-            json_string = match.group(1).strip()
-        else:
-            json_string = raw_plan_str.strip()
-        
-        plan = json.loads(json_string)
+        plan = extract_json_block(raw_plan_str)
+        if is_valid_plan(plan):
+            steps = plan['plan']
+            first_command = str(steps[0]['command']).strip().upper()
+            is_chat = len(steps) == 1 and (first_command == 'REPLY' or first_command.startswith('CMD ECHO'))
+            intent_router.record_prompt(user_prompt, 'chat' if is_chat else 'task')
+            if request_config.PLAN_CACHE_TTL:
+                shared_state.set(plan_key, plan, ttl=request_config.PLAN_CACHE_TTL)
+        history_store.record_plan(user_prompt, 'model', plan, (time.perf_counter() - started) * 1000)
         return jsonify(plan)
     except json.JSONDecodeError as e:
         logging.error(f"Failed to decode JSON from Gemini: {e}\nRaw response:\n{raw_plan_str}")
+        history_store.record_plan(user_prompt, 'model_error', None, (time.perf_counter() - started) * 1000)
         error_message = "Failed to get a valid plan from the AI."
         if "quota" in raw_plan_str.lower():
             error_message = "The AI is a bit tired right now (API quota exceeded). Please try again later, my love. 💖"
         return jsonify({"error": error_message, "details": raw_plan_str}), 500
 
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    try:
+        limit = min(max(int(request.args.get('limit', config.HISTORY_PAGE_SIZE)), 1), 200)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    search = request.args.get('q', '').strip() or None
+    kind = request.args.get('kind', 'runs')
+
+    if kind == 'runs':
+        items, total = history_store.query_runs(limit, offset, search)
+    elif kind == 'plans':
+        items, total = history_store.query_plans(limit, offset, search)
+    else:
+        return jsonify({"error": "kind must be 'runs' or 'plans'"}), 400
+    return jsonify({"kind": kind, "items": items, "total": total, "limit": limit, "offset": offset})
+
+@app.route('/api/screenshot', methods=['GET'])
+def get_screenshot():
+    try:
+        image_format = normalize_format(request.args.get('format', config.SCREENSHOT_FORMAT))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        quality = min(max(int(request.args.get('quality', config.SCREENSHOT_QUALITY)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "quality must be an integer"}), 400
+    region = None
+    if request.args.get('region'):
+        region = parse_region(f"region {request.args['region']}")
+        if not region:
+            return jsonify({"error": "region must be x,y,width,height"}), 400
+    diff = request.args.get('diff', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        result = screen_capture.capture(region, image_format, quality, diff).result(timeout=config.SCREENSHOT_SAVE_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        logging.error(f"Timed out after {config.SCREENSHOT_SAVE_TIMEOUT}s encoding a screenshot.")
+        return jsonify({"error": "Timed out encoding the screenshot."}), 504
+    except Exception as e:
+        logging.error(f"Failed to capture screenshot: {e}")
+        return jsonify({"error": "Could not capture the screen."}), 500
+
+    headers = {"X-Capture-Encode-Ms": f"{result.encode_ms:.1f}"}
+    if not result.changed:
+        return Response(status=204, headers=headers)
+    headers["X-Capture-Region"] = ",".join(str(value) for value in result.region)
+    return Response(result.data, mimetype=result.mimetype, headers=headers)
+
+@app.route('/api/speculation/stats', methods=['GET'])
+def get_speculation_stats():
+    stats = speculative_planner.report()
+    stats['enabled'] = config.SPECULATION_ENABLED
+    stats['budget_per_minute'] = config.SPECULATIVE_CALLS_PER_MINUTE
+    return jsonify(stats)
+
 @app.route('/api/user/info', methods=['GET'])
 def get_user_info():
     try:
@@ -823,18 +2237,20 @@ def execute_plan_stream():
     if not plan:
         return jsonify({"error": "Plan is required"}), 400
 
-    def generate_stream():
-        q = []
-        def log_callback(message):
-            q.append(message)
+    request_config = config
+    events = SSEEventQueue(json_payloads=data.get('events') == 'json', max_coalesced_chars=request_config.SSE_MAX_COALESCED_CHARS)
 
-        executor = ActionExecutor(plan, gemini_controller, original_prompt, log_callback, system_context, config)
+    def generate_stream():
+        executor = ActionExecutor(plan, gemini_controller, original_prompt, events.put, system_context, request_config, recovery_cache, history_store)
         executor.start()
-
-        while executor.is_alive() or q:
-            while q:
-                yield q.pop(0)
-            time.sleep(0.1)
+        try:
+            yield from events.stream(executor.is_alive, request_config.SSE_FLUSH_INTERVAL, request_config.SSE_HEARTBEAT_INTERVAL)
+        finally:
+            # Closing the generator early means the client went away; don't leave the executor running for nobody.
+            if executor.is_alive():
+                executor.cancel()
+        if original_prompt and executor._success:
+            speculative_planner.prefetch_after(original_prompt, request_config)
 
     return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
 
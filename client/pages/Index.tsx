@@ -25,7 +25,7 @@ export default function Index() {
   const [bubbleStyle, setBubbleStyle] = useState<string>(() => localStorage.getItem("acrobot_bubble") || document.documentElement.dataset.bubble || "glass");
   const [isTyping, setIsTyping] = useState(false);
   const [username, setUsername] = useState<string>("User");
-  type BotMode = "ready" | "thinking" | "awaiting" | "executing" | "interpreting" | "completed" | "failed";
+  type BotMode = "ready" | "thinking" | "awaiting" | "executing" | "recovering" | "interpreting" | "completed" | "failed";
   const [mode, setMode] = useState<BotMode>("ready");
   const listRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLInputElement>(null);
@@ -109,27 +109,30 @@ export default function Index() {
       const execRes = await fetch(`${API_BASE}/api/execute`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ plan, prompt: text }),
+        body: JSON.stringify({ plan, prompt: text, events: "json" }),
       });
 
       const reader = execRes.body!.getReader();
       const decoder = new TextDecoder();
+      let buffer = "";
 
       while (true) {
         const { value, done } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n\n").filter(line => line.trim() !== "");
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop() ?? "";
 
-        for (const line of lines) {
-          const [event, data] = line.replace("event: ", "").replace("data: ", "").split("\n");
+        for (const frame of frames) {
+          const { event, data } = parseSseFrame(frame);
+          if (!event) continue;
 
           if (event === "assistant_message") {
-            setMessages(prev => [...prev, { id: genId(), role: "assistant", content: data, createdAt: Date.now() }]);
+            setMessages(prev => [...prev, { id: genId(), role: "assistant", content: data.message, createdAt: Date.now() }]);
             requestAnimationFrame(() => listRef.current?.scrollTo({ top: 1e9, behavior: "smooth" }));
           } else if (event === "status") {
-            setMode(data as BotMode);
+            setMode(data.message as BotMode);
           }
         }
       }
@@ -307,6 +310,30 @@ export default function Index() {
   );
 }
 
+interface SseEventData {
+  message: string;
+  step: number | null;
+  ts: number;
+}
+
+function parseSseFrame(frame: string): { event: string; data: SseEventData } {
+  let event = "";
+  const dataLines: string[] = [];
+  for (const line of frame.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice(line.startsWith("data: ") ? 6 : 5));
+    }
+  }
+  const raw = dataLines.join("\n");
+  try {
+    return { event, data: JSON.parse(raw) as SseEventData };
+  } catch {
+    return { event, data: { message: raw, step: null, ts: Date.now() / 1000 } };
+  }
+}
+
 function NeonBackdrop() {
   return (
     <div className="pointer-events-none absolute inset-0 -z-10">
@@ -390,12 +417,13 @@ function Confetti() {
   );
 }
 
-function ModeBadge({ mode }: { mode: "ready"|"thinking"|"awaiting"|"executing"|"interpreting"|"completed"|"failed" }) {
+function ModeBadge({ mode }: { mode: "ready"|"thinking"|"awaiting"|"executing"|"recovering"|"interpreting"|"completed"|"failed" }) {
   const map = {
     ready: { label: "Ready / Idle", cls: "border-white/15 text-white/80 bg-white/5" },
     thinking: { label: "Thinking / Generating Plan", cls: "border-brand-pink/30 text-white bg-white/5 animate-pulse" },
     awaiting: { label: "Awaiting Confirmation", cls: "border-brand-blue/30 text-white bg-white/5" },
     executing: { label: "Executing", cls: "border-brand-blue/50 text-white bg-white/5" },
+    recovering: { label: "Recovering From Error", cls: "border-brand-pink/50 text-white bg-white/5 animate-pulse" },
     interpreting: { label: "Interpreting Output", cls: "border-white/15 text-white bg-white/5" },
     completed: { label: "Task Completed", cls: "border-white/20 text-white bg-white/10" },
     failed: { label: "Recovery Failed", cls: "border-destructive text-destructive-foreground/80 bg-destructive/15" },
@@ -403,7 +431,7 @@ function ModeBadge({ mode }: { mode: "ready"|"thinking"|"awaiting"|"executing"|"
   const curr = map[mode];
   return (
     <div className={cn("relative inline-flex items-center gap-2 rounded-lg border px-3 py-1 text-xs", curr.cls)}>
-      {mode === "thinking" && <Loader2 className="h-3.5 w-3.5 animate-spin" />}
+      {(mode === "thinking" || mode === "recovering") && <Loader2 className="h-3.5 w-3.5 animate-spin" />}
       {mode === "executing" && <Clock className="h-3.5 w-3.5" />}
       {mode === "completed" && <CheckCircle2 className="h-3.5 w-3.5" />}
       {mode === "failed" && <AlertTriangle className="h-3.5 w-3.5" />}
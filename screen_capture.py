@@ -0,0 +1,154 @@
+import io
+import sys
+import time
+import logging
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageDraw
+
+IMAGE_FORMATS = {
+    'png': {'format': 'PNG', 'extension': '.png', 'mimetype': 'image/png'},
+    'jpeg': {'format': 'JPEG', 'extension': '.jpg', 'mimetype': 'image/jpeg'},
+    'webp': {'format': 'WEBP', 'extension': '.webp', 'mimetype': 'image/webp'},
+}
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+def normalize_format(image_format):
+    image_format = (image_format or 'png').lower()
+    image_format = FORMAT_ALIASES.get(image_format, image_format)
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format '{image_format}'. Use png, jpeg or webp.")
+    return image_format
+
+def encode_image(image, image_format='png', quality=80):
+    image_format = normalize_format(image_format)
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        # Level 1 is several times faster than the default level 6 on a full desktop and only slightly larger.
+        image.save(buffer, format='PNG', compress_level=1)
+    elif image_format == 'jpeg':
+        image.convert('RGB').save(buffer, format='JPEG', quality=quality)
+    else:
+        image.save(buffer, format='WEBP', quality=quality, method=0)
+    return buffer.getvalue()
+
+def changed_region(previous, current):
+    if previous is None or previous.size != current.size or previous.mode != current.mode:
+        return (0, 0) + current.size
+    return ImageChops.difference(previous, current).getbbox()
+
+class CaptureResult:
+    def __init__(self, data, image_format, region, size, changed, encode_ms):
+        self.data = data
+        self.image_format = image_format
+        self.region = region
+        self.size = size
+        self.changed = changed
+        self.encode_ms = encode_ms
+
+    @property
+    def mimetype(self):
+        return IMAGE_FORMATS[self.image_format]['mimetype']
+
+class ScreenCapture:
+    MAX_REFERENCE_REGIONS = 4
+
+    def __init__(self, grab=None, max_reference_regions=MAX_REFERENCE_REGIONS):
+        self._grab = grab or self._grab_screen
+        # A single worker keeps encodes in capture order, which diff mode relies on.
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screen-capture')
+        # Reference frames for diff mode, least recently used region first.
+        self._reference_frames = {}
+        self.max_reference_regions = max_reference_regions
+        self._lock = threading.Lock()
+
+    def _grab_screen(self, region=None):
+        import pyautogui
+        return pyautogui.screenshot(region=region)
+
+    def _update_reference(self, region, frame):
+        # The reference buffer is reused across captures of the same region; only a new size or mode reallocates it.
+        reference = self._reference_frames.pop(region, None)
+        if reference is not None and reference.size == frame.size and reference.mode == frame.mode:
+            reference.paste(frame)
+        else:
+            reference = frame.copy()
+        self._reference_frames[region] = reference
+        while len(self._reference_frames) > self.max_reference_regions:
+            del self._reference_frames[next(iter(self._reference_frames))]
+
+    def _process(self, frame, region, image_format, quality, diff):
+        started = time.perf_counter()
+        bbox = (0, 0) + frame.size
+        if diff:
+            with self._lock:
+                bbox = changed_region(self._reference_frames.get(region), frame)
+                self._update_reference(region, frame)
+        if bbox is None:
+            return CaptureResult(b"", image_format, None, frame.size, False, (time.perf_counter() - started) * 1000)
+
+        image = frame if bbox == (0, 0) + frame.size else frame.crop(bbox)
+        data = encode_image(image, image_format, quality)
+        offset_x, offset_y = (region[0], region[1]) if region else (0, 0)
+        screen_region = (bbox[0] + offset_x, bbox[1] + offset_y, bbox[2] - bbox[0], bbox[3] - bbox[1])
+        return CaptureResult(data, image_format, screen_region, frame.size, True, (time.perf_counter() - started) * 1000)
+
+    def capture(self, region=None, image_format='png', quality=80, diff=False):
+        image_format = normalize_format(image_format)
+        region = tuple(region) if region else None
+        frame = self._grab(region=region)
+        return self._worker.submit(self._process, frame, region, image_format, quality, diff)
+
+    def capture_to_file(self, filepath, region=None, image_format='png', quality=80):
+        image_format = normalize_format(image_format)
+        region = tuple(region) if region else None
+        frame = self._grab(region=region)
+        return self._worker.submit(self._write_file, filepath, frame, region, image_format, quality)
+
+    def _write_file(self, filepath, frame, region, image_format, quality):
+        result = self._process(frame, region, image_format, quality, False)
+        with open(filepath, 'wb') as f:
+            f.write(result.data)
+        logging.info(f"✅ Screenshot saved to {filepath}")
+        return result
+
+    def shutdown(self):
+        self._worker.shutdown(wait=True)
+
+def synthetic_frame(width, height, seed=0):
+    frame = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(frame)
+    for i in range(40):
+        x = (i * 977) % max(width - 200, 1)
+        y = (i * 613) % max(height - 120, 1)
+        # Only the first couple of windows change between seeds, like a clock or a chat window updating.
+        tint = seed * 40 if i < 2 else 0
+        draw.rectangle((x, y, x + 200, y + 120), fill=((i * 53 + tint) % 256, (i * 97) % 256, (i * 31) % 256))
+        draw.text((x + 10, y + 10), f"Window {i} frame {seed if i < 2 else 0}", fill=(255, 255, 255))
+    return frame
+
+def benchmark(width=3840, height=2160, rounds=5, quality=80):
+    frames = [synthetic_frame(width, height, seed) for seed in range(2)]
+    results = {}
+    for image_format in IMAGE_FORMATS:
+        capture = ScreenCapture(grab=lambda region=None: frames[0])
+        started = time.perf_counter()
+        sizes = [len(capture.capture(image_format=image_format, quality=quality).result().data) for _ in range(rounds)]
+        results[image_format] = {'ms_per_frame': (time.perf_counter() - started) * 1000 / rounds, 'bytes': sizes[-1]}
+        capture.shutdown()
+
+    # Diff mode: alternate between two frames that differ only in a few windows.
+    counter = itertools.count()
+    capture = ScreenCapture(grab=lambda region=None: frames[next(counter) % 2])
+    capture.capture(diff=True).result()
+    started = time.perf_counter()
+    diffs = [capture.capture(diff=True).result() for _ in range(rounds)]
+    results['png_diff'] = {'ms_per_frame': (time.perf_counter() - started) * 1000 / rounds, 'bytes': len(diffs[-1].data), 'region': diffs[-1].region}
+    capture.shutdown()
+    return results
+
+if __name__ == "__main__":
+    width, height = (int(value) for value in (sys.argv[1:3] if len(sys.argv) >= 3 else (3840, 2160)))
+    for name, result in benchmark(width, height).items():
+        print(f"{name:>9}: {result['ms_per_frame']:8.1f} ms/frame, {result['bytes']:>9} bytes" + (f", region {result['region']}" if 'region' in result else ""))
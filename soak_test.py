@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+
+# Usage: python soak_test.py --plans 5000 --concurrency 8 --disconnect-rate 0.3
+# Drives /api/plan and /api/execute through Flask's test client with a stub model and a fake command
+# backend, samples threads / file descriptors / child processes / RSS / latency, and exits non-zero if any of them trend upward.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TASK_PROMPTS = [
+    "make a folder called {} on my desktop", "open notepad and type {}", "search for {} files in documents",
+    "rename the {} folder", "check how much disk space {} uses", "open {} in the browser",
+]
+CHAT_PROMPTS = ["hi", "good morning", "i love you", "how are you", "thank you", "i missed you"]
+WORDS = ["cozy", "notes", "music", "photos", "work", "games", "recipes", "taxes", "travel", "ideas"]
+# Stands in for a shell command: sleeps, prints some output, and exits with the given code.
+CHILD_SCRIPT = (
+    "import sys, time; time.sleep(float(sys.argv[1])); "
+    "print('\\n'.join(f'output line {n}' for n in range(int(sys.argv[2])))); "
+    "code = int(sys.argv[3]); code and print(\"'thing' is not recognized as a command\", file=sys.stderr); sys.exit(code)"
+)
+
+class StubModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        time.sleep(random.uniform(*self.latency))
+        if "fixing one failed step" in prompt:
+            text = json.dumps({"fix": [{"step": 1, "command": "CMD echo fixed", "narration": "Fixed it, love."}]})
+        elif "Analyze this output" in prompt:
+            text = "Here's what I found for you, sweetheart."
+        elif "Your partner:" in prompt:
+            text = "Aww, I'm right here with you 💕"
+        else:
+            steps = [
+                {"step": i + 1, "command": f"CMD echo step {i + 1}", "narration": f"Doing step {i + 1} for you.", "interpret_output": i == 0}
+                for i in range(random.randint(1, 4))
+            ]
+            text = json.dumps({"plan": steps})
+        return type("StubResponse", (), {"text": f"```json\n{text}\n```" if text.startswith("{") else text})()
+
+def make_fake_executor(acrobot, failure_rate, slow_rate, cancel_lags):
+    lock = threading.Lock()
+
+    class FakeCommandExecutor(acrobot.ActionExecutor):
+        # Only the process launch is faked: each command runs a real child process through the executor's own
+        # _run_process, so a disconnect mid-step exercises the same kill-on-cancel path as a real shell command.
+        cancel_requested_at = None
+
+        def cancel(self):
+            self.cancel_requested_at = self.cancel_requested_at or time.monotonic()
+            super().cancel()
+
+        def _run_process(self, args, shell=False):
+            command = args if isinstance(args, str) else " ".join(args)
+            duration = random.uniform(1.0, 3.0) if random.random() < slow_rate else random.uniform(0.001, 0.02)
+            exit_code = 1 if "fixed" not in command and random.random() < failure_rate else 0
+            child_args = [sys.executable, "-c", CHILD_SCRIPT, str(duration), str(random.randint(1, 40)), str(exit_code)]
+            started = time.monotonic()
+            try:
+                return super()._run_process(child_args)
+            finally:
+                if self.cancel_requested_at:
+                    # How long the child outlived the cancel; a child that is not killed runs out its full duration.
+                    with lock:
+                        cancel_lags.append(time.monotonic() - max(self.cancel_requested_at, started))
+
+    return FakeCommandExecutor
+
+def load_app(args, cancel_lags):
+    workdir = tempfile.mkdtemp(prefix="acrobot_soak_")
+    shutil.copy(os.path.join(REPO_DIR, "commands that are obv.txt"), workdir)
+    with open(os.path.join(workdir, "acrobot_config.json"), "w") as f:
+        json.dump({"GEMINI_API_KEY": "soak-test-stub-key", "SSE_HEARTBEAT_INTERVAL": 0.5}, f)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import acrobot
+
+    acrobot.gemini_controller.model = StubModel((args.model_latency_ms[0] / 1000, args.model_latency_ms[1] / 1000))
+    acrobot.ActionExecutor = make_fake_executor(acrobot, args.failure_rate, args.slow_rate, cancel_lags)
+    return acrobot, workdir
+
+def random_prompt():
+    if random.random() < 0.25:
+        return random.choice(CHAT_PROMPTS)
+    return random.choice(TASK_PROMPTS).format(random.choice(WORDS))
+
+class SoakRun:
+    def __init__(self, acrobot, args):
+        self.client = acrobot.app.test_client()
+        self.args = args
+        self.latencies = []
+        self.errors = 0
+        self.disconnects = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def one_session(self, _):
+        started = time.perf_counter()
+        try:
+            prompt = random_prompt()
+            plan_response = self.client.post('/api/plan', json={"prompt": prompt})
+            if plan_response.status_code != 200:
+                raise RuntimeError(f"/api/plan returned {plan_response.status_code}")
+            plan = plan_response.get_json()["plan"]
+
+            response = self.client.post('/api/execute', json={"plan": plan, "prompt": prompt, "events": "json"}, buffered=False)
+            disconnect_after = random.randint(1, 3) if random.random() < self.args.disconnect_rate else None
+            for chunk_count, _ in enumerate(response.response, start=1):
+                if disconnect_after and chunk_count >= disconnect_after:
+                    break
+            response.close()
+            with self._lock:
+                self.latencies.append(time.perf_counter() - started)
+                self.completed += 1
+                self.disconnects += 1 if disconnect_after else 0
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"session error: {e}", file=sys.stderr)
+
+    def drain_latencies(self):
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+def open_handles(process):
+    return process.num_handles() if hasattr(process, "num_handles") else process.num_fds()
+
+def sample(process, run, started, recent_latencies):
+    # p95 over a rolling window of samples: a couple of slow steps landing in one interval should not look like a trend.
+    recent_latencies.append(run.drain_latencies())
+    latencies = [latency for batch in recent_latencies for latency in batch]
+    return {
+        "t": time.perf_counter() - started,
+        "threads": threading.active_count(),
+        "handles": open_handles(process),
+        "children": len(process.children(recursive=True)),
+        "rss_mb": process.memory_info().rss / (1024 * 1024),
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) >= 20 else None,
+        "sessions": run.completed,
+    }
+
+def slope(points):
+    xs, ys = zip(*points)
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator if denominator else 0.0
+
+def check_trends(samples, args):
+    # Once fewer sessions than --concurrency are left, only the slowest stragglers are running; that is not load.
+    loaded = [s for s in samples if s["sessions"] <= args.plans - args.concurrency]
+    steady = loaded[int(len(loaded) * args.warmup):]
+    if len(steady) < 4:
+        return ["not enough samples after warm-up; run longer or sample more often"]
+    duration = steady[-1]["t"] - steady[0]["t"]
+    limits = {
+        "threads": args.max_thread_growth, "handles": args.max_handle_growth,
+        "children": args.max_child_growth, "rss_mb": args.max_rss_growth_mb,
+    }
+    failures = []
+    for metric, limit in limits.items():
+        growth = slope([(s["t"], s[metric]) for s in steady]) * duration
+        if growth > limit:
+            failures.append(f"{metric} trended up by {growth:.1f} over the steady phase (limit {limit})")
+    latency_points = [(s["t"], s["p95_ms"]) for s in steady if s["p95_ms"] is not None]
+    if len(latency_points) >= 4:
+        baseline = statistics.median(p for _, p in latency_points[:max(len(latency_points) // 4, 1)])
+        growth = slope(latency_points) * duration
+        if baseline and growth / baseline > args.max_latency_growth:
+            failures.append(f"p95 latency trended up by {growth:.0f} ms from ~{baseline:.0f} ms (limit {args.max_latency_growth:.0%})")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test /api/plan and /api/execute with a stub model and fake command backend.")
+    parser.add_argument("--plans", type=int, default=2000, help="number of plan+execute sessions to run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--disconnect-rate", type=float, default=0.3, help="fraction of streams the client abandons early")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="fraction of fake steps that fail and trigger recovery")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of fake steps that take 1-3 seconds")
+    parser.add_argument("--model-latency-ms", type=float, nargs=2, default=(2, 20))
+    parser.add_argument("--sample-interval", type=float, default=2.0, help="seconds between resource samples")
+    parser.add_argument("--latency-window", type=int, default=5, help="number of samples the p95 latency is computed over")
+    parser.add_argument("--warmup", type=float, default=0.2, help="fraction of samples ignored for trend checks")
+    parser.add_argument("--settle", type=float, default=10.0, help="seconds to wait for threads to drain after the load stops")
+    parser.add_argument("--max-thread-growth", type=float, default=4)
+    parser.add_argument("--max-handle-growth", type=float, default=16)
+    parser.add_argument("--max-child-growth", type=float, default=4)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32)
+    parser.add_argument("--max-latency-growth", type=float, default=0.5)
+    parser.add_argument("--max-cancel-lag", type=float, default=1.0, help="seconds a command may outlive its run's cancellation")
+    parser.add_argument("--csv", help="write the samples to this CSV file")
+    args = parser.parse_args()
+
+    cancel_lags = []
+    acrobot, workdir = load_app(args, cancel_lags)
+    process = psutil.Process()
+    time.sleep(1)  # let the background startup threads (context gathering, watchers) settle
+    baseline_threads = threading.active_count()
+    run = SoakRun(acrobot, args)
+    samples = []
+    recent_latencies = deque(maxlen=max(args.latency_window, 1))
+    started = time.perf_counter()
+    finished = threading.Event()
+
+    def sampler():
+        while not finished.wait(args.sample_interval):
+            samples.append(sample(process, run, started, recent_latencies))
+            s = samples[-1]
+            print(f"{s['t']:7.1f}s  sessions={s['sessions']:6d}  threads={s['threads']:4d}  handles={s['handles']:5d}  "
+                  f"children={s['children']:3d}  rss={s['rss_mb']:7.1f} MB  p95=" + (f"{s['p95_ms']:7.1f} ms" if s['p95_ms'] is not None else "    n/a"))
+
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    sampler_thread.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run.one_session, range(args.plans)))
+    finished.set()
+    sampler_thread.join()
+
+    # Every abandoned stream should have cancelled its executor, so threads and child processes must drain away.
+    settle_deadline = time.monotonic() + args.settle
+    while (threading.active_count() > baseline_threads + 1 or process.children()) and time.monotonic() < settle_deadline:
+        time.sleep(0.1)
+    leftover_threads = threading.active_count() - baseline_threads
+    leftover_children = process.children(recursive=True)
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write("t,threads,handles,children,rss_mb,p95_ms,sessions\n")
+            for s in samples:
+                f.write(f"{s['t']:.2f},{s['threads']},{s['handles']},{s['children']},{s['rss_mb']:.2f},{s['p95_ms'] or ''},{s['sessions']}\n")
+
+    failures = check_trends(samples, args)
+    if leftover_threads > 1:
+        failures.append(f"{leftover_threads} thread(s) still alive {args.settle:.0f}s after the load stopped")
+    if leftover_children:
+        failures.append(f"{len(leftover_children)} child process(es) still running {args.settle:.0f}s after the load stopped")
+    if run.errors:
+        failures.append(f"{run.errors} session(s) raised errors")
+    slow_releases = [lag for lag in cancel_lags if lag > args.max_cancel_lag]
+    if slow_releases:
+        failures.append(f"{len(slow_releases)} command(s) kept running up to {max(slow_releases):.1f}s after their run was cancelled")
+
+    print(f"\n{run.completed} sessions, {run.disconnects} early disconnects, {run.errors} errors in {time.perf_counter() - started:.1f}s (workdir {workdir})")
+    if cancel_lags:
+        print(f"{len(cancel_lags)} running command(s) cancelled, slowest released after {max(cancel_lags) * 1000:.0f} ms")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ No upward resource or latency trend detected.")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
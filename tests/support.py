@@ -0,0 +1,17 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# acrobot builds its globals on import, so load it from a scratch directory with a throwaway config.
+WORKDIR = tempfile.mkdtemp(prefix="acrobot_tests_")
+CONFIG_PATH = os.path.join(WORKDIR, "acrobot_config.json")
+shutil.copy(os.path.join(REPO_DIR, "commands that are obv.txt"), WORKDIR)
+with open(CONFIG_PATH, "w") as f:
+    json.dump({"GEMINI_API_KEY": "test-key"}, f)
+os.chdir(WORKDIR)
+sys.path.insert(0, REPO_DIR)
+import acrobot
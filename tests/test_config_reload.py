@@ -0,0 +1,41 @@
+import json
+import unittest
+
+from support import CONFIG_PATH, acrobot
+
+class ConfigReloadTest(unittest.TestCase):
+    def setUp(self):
+        with open(CONFIG_PATH) as f:
+            self.original = f.read()
+
+    def tearDown(self):
+        with open(CONFIG_PATH, "w") as f:
+            f.write(self.original)
+        acrobot.reload_config(CONFIG_PATH)
+
+    def write_config(self, text):
+        with open(CONFIG_PATH, "w") as f:
+            f.write(text)
+
+    def test_valid_config_is_published(self):
+        self.write_config(json.dumps({"GEMINI_API_KEY": "test-key", "DRY_RUN_MODE": True, "SHELL_TYPE": "powershell"}))
+        acrobot.reload_config(CONFIG_PATH)
+        self.assertTrue(acrobot.config.DRY_RUN_MODE)
+        self.assertEqual(acrobot.gemini_controller.config.SHELL_TYPE, "powershell")
+
+    def test_invalid_config_keeps_current_snapshot(self):
+        self.write_config(json.dumps({"GEMINI_API_KEY": "test-key", "DRY_RUN_MODE": True, "SHELL_TYPE": "powershell"}))
+        acrobot.reload_config(CONFIG_PATH)
+        current = acrobot.config
+
+        for text in ['{"DRY_RUN_MODE": tr', '["not", "an", "object"]']:
+            self.write_config(text)
+            with self.assertRaises(ValueError):
+                acrobot.reload_config(CONFIG_PATH)
+            self.assertIs(acrobot.config, current)
+            self.assertIs(acrobot.gemini_controller.config, current)
+            self.assertTrue(acrobot.config.DRY_RUN_MODE)
+            self.assertEqual(acrobot.config.SHELL_TYPE, "powershell")
+
+if __name__ == "__main__":
+    unittest.main()
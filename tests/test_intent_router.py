@@ -0,0 +1,64 @@
+import os
+import json
+import unittest
+
+from support import WORKDIR, acrobot
+
+THRESHOLD = acrobot.Config.CHAT_ROUTER_THRESHOLD
+
+class IntentRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.log_file = os.path.join(WORKDIR, "prompt_log_test.jsonl")
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.router = acrobot.IntentRouter(acrobot.predefined_commands.commands.keys(), self.log_file)
+
+    def assertIntent(self, prompt, intent):
+        self.assertEqual(self.router.classify(prompt, THRESHOLD)[0], intent, prompt)
+
+    def test_pure_chat(self):
+        for prompt in ["hi", "hey babe!", "good morning love 💕", "i love you", "how are you?", "hi, i love you", "yo babe what's up"]:
+            self.assertIntent(prompt, 'chat')
+
+    def test_greeting_followed_by_task(self):
+        for prompt in [
+            "thanks! now lock my computer",
+            "hello, please lock the screen",
+            "hey what's the weather in paris",
+            "good morning, what's on my calendar today",
+            "thanks, now email mom",
+        ]:
+            self.assertIntent(prompt, 'task')
+
+    def test_plain_tasks(self):
+        for prompt in ["remind me to drink water", "open notepad", "how much ram do i have"]:
+            self.assertIntent(prompt, 'task')
+
+    def test_keyword_free_tasks_reach_the_planner(self):
+        # None of these hit TASK_PATTERN, so they exercise the classifier; sending them to chat would drop the command.
+        prompts = [
+            "empty the recycle bin", "hey, empty the recycle bin", "log me off", "translate hello to french",
+            "sign me out", "convert 5 miles to km", "clean up temp stuff", "please empty the recycle bin",
+            "can you log me off",
+        ]
+        for prompt in prompts:
+            self.assertIsNone(acrobot.IntentRouter.TASK_PATTERN.search(prompt), prompt)
+            for threshold in (0.8, THRESHOLD):
+                self.assertEqual(self.router.classify(prompt, threshold)[0], 'task', prompt)
+
+    def test_classifier_still_routes_conversation_to_chat(self):
+        for prompt in ["i'm tired", "i had a rough day", "do you love me", "what's your name", "my day was good", "are you real"]:
+            self.assertIsNone(acrobot.IntentRouter.CHAT_PATTERN.fullmatch(prompt), prompt)
+            self.assertIntent(prompt, 'chat')
+
+    def test_corrupt_prompt_log_lines_are_skipped(self):
+        with open(self.log_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"prompt": "sing me a song", "intent": "chat"}) + "\n")
+            f.write('{"prompt": "half a li\n')
+            f.write(json.dumps({"prompt": "water the plants", "intent": "task"}) + "\n")
+        router = acrobot.IntentRouter([], self.log_file)
+        self.assertEqual(router.label_counts['chat'], len(acrobot.IntentRouter.CHAT_EXAMPLES) + 1)
+        self.assertEqual(router.label_counts['task'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
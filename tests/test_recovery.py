@@ -0,0 +1,100 @@
+import os
+import json
+import unittest
+
+from support import WORKDIR, acrobot
+
+class StubController:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def build_recovery_prompt(self, failed_step, reason, error_output, remaining_steps, config=None):
+        return f"fix {failed_step['command']}"
+
+    def generate_plan(self, user_prompt, recovery_prompt="", log_emitter=None, config=None):
+        self.calls += 1
+        return "```json\n" + json.dumps(self.responses.pop(0)) + "\n```"
+
+    def interpret_output(self, original_prompt, command, command_output, config=None):
+        return ""
+
+class StubExecutor(acrobot.ActionExecutor):
+    def __init__(self, plan, controller, recovery_cache, failing):
+        super().__init__(plan, controller, "do the thing", None, None, acrobot.config, recovery_cache)
+        self.failing = failing
+        self.executed = []
+
+    def send_smart_message(self, message):
+        pass
+
+    def execute_step(self, step_command, wait_for_completion=True):
+        self.executed.append(step_command)
+        if step_command in self.failing:
+            return False, "CMD command failed with return code 1.", "'thing' is not recognized as a command", False
+        return True, "", "", False
+
+class RecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_file = os.path.join(WORKDIR, "recovery_cache_test.json")
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        self.cache = acrobot.RecoveryCache(self.cache_file)
+        self.plan = [{"command": "CMD first"}, {"command": "CMD broken"}, {"command": "CMD last"}]
+
+    def run_plan(self, controller, failing, plan=None):
+        executor = StubExecutor(plan or self.plan, controller, self.cache, failing)
+        executor.run()
+        return executor
+
+    def test_fix_is_spliced_in_without_rerunning_completed_steps(self):
+        controller = StubController([{"fix": [{"command": "CMD repaired"}]}])
+        executor = self.run_plan(controller, {"CMD broken"})
+        self.assertTrue(executor._success)
+        self.assertEqual(executor.executed, ["CMD first", "CMD broken", "CMD repaired", "CMD last"])
+        self.assertEqual(controller.calls, 1)
+
+    def test_cached_fix_is_applied_without_a_model_call(self):
+        self.run_plan(StubController([{"fix": [{"command": "CMD repaired"}]}]), {"CMD broken"})
+
+        controller = StubController([])
+        executor = self.run_plan(controller, {"CMD broken"})
+        self.assertTrue(executor._success)
+        self.assertEqual(executor.executed, ["CMD first", "CMD broken", "CMD repaired", "CMD last"])
+        self.assertEqual(controller.calls, 0)
+
+    def test_cached_rewrite_of_remaining_steps_only_applies_to_the_same_tail(self):
+        self.run_plan(StubController([{"fix": [{"command": "CMD repaired"}], "remaining": [{"command": "CMD last v2"}]}]), {"CMD broken"})
+
+        executor = self.run_plan(StubController([]), {"CMD broken"})
+        self.assertEqual(executor.executed[2:], ["CMD repaired", "CMD last v2"])
+
+        other_plan = [{"command": "CMD broken"}, {"command": "CMD something else"}]
+        executor = self.run_plan(StubController([]), {"CMD broken"}, other_plan)
+        self.assertEqual(executor.executed, ["CMD broken", "CMD repaired", "CMD something else"])
+
+    def test_failing_cached_fix_is_evicted(self):
+        self.run_plan(StubController([{"fix": [{"command": "CMD repaired"}]}]), {"CMD broken"})
+        key = acrobot.RecoveryCache.make_key(acrobot.config.SHELL_TYPE, "CMD broken", "'thing' is not recognized as a command")
+        self.assertIn(key, self.cache.fixes)
+
+        controller = StubController([{"fix": [{"command": "CMD repaired again"}]}])
+        executor = self.run_plan(controller, {"CMD broken", "CMD repaired"})
+        self.assertTrue(executor._success)
+        self.assertEqual(controller.calls, 1)
+        self.assertNotIn(key, self.cache.fixes)
+        self.assertNotIn(key, acrobot.RecoveryCache(self.cache_file).fixes)
+
+        # With the stale entry gone, the next identical failure asks the model instead of replaying it.
+        controller = StubController([{"fix": [{"command": "CMD fresh fix"}]}])
+        executor = self.run_plan(controller, {"CMD broken", "CMD repaired"})
+        self.assertEqual(controller.calls, 1)
+        self.assertIn("CMD fresh fix", executor.executed)
+
+    def test_fixes_are_not_shared_across_shells(self):
+        self.run_plan(StubController([{"fix": [{"command": "CMD repaired"}]}]), {"CMD broken"})
+        key = acrobot.RecoveryCache.make_key("powershell" if acrobot.config.SHELL_TYPE != "powershell" else "cmd", "CMD broken", "'thing' is not recognized as a command")
+        self.assertIsNone(self.cache.get_fix(key, []))
+
+if __name__ == "__main__":
+    unittest.main()